@@ -0,0 +1,68 @@
+"""
+Request id tracking benchmark.
+The goal is to compare the memory and time cost of the HUBSTORAGE_REQUEST_TRACKING
+modes: in-flight requests go through the downloader middleware, then the
+spider middleware gets the parent id of their children from the responses.
+Only the memory allocated by the middlewares is traced.
+
+Usage: python benchmarks/request_tracking.py [number of requests]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.middlewares import (HubstorageDownloaderMiddleware,
+                                   HubstorageSpiderMiddleware, seen_requests)
+
+
+class NullWriter:
+    def write_request(self, **kwargs):
+        pass
+
+
+def run(mode, count):
+    crawler = get_crawler(settings_dict={
+        'HUBSTORAGE_REQUEST_TRACKING': mode,
+        'HUBSTORAGE_REQUEST_FINGERPRINT': False,
+    })
+    downloader_mw = HubstorageDownloaderMiddleware(crawler)
+    downloader_mw.pipe_writer = NullWriter()
+    spider_mw = HubstorageSpiderMiddleware(crawler)
+    requests = [Request('http://example.com/{}'.format(i)) for i in range(count)]
+    responses = [Response(request.url, request=request) for request in requests]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for request, response in zip(requests, responses):
+        downloader_mw._process_request(request)
+        downloader_mw._process_response(request, response)
+    for response in responses:
+        spider_mw._get_parent(response)
+    elapsed = time.perf_counter() - start
+    # peak memory used by the tracking of in-flight requests
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    gc.collect()
+    collect = time.perf_counter() - start
+    del requests, responses
+    seen_requests.clear()
+    return traced, elapsed, collect
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print('{} requests'.format(count))
+    for mode in ('weakref', 'meta'):
+        traced, elapsed, collect = run(mode, count)
+        print('{:8} {:8.1f} MB peak traced, {:6.2f} s, full gc.collect {:.2f} s'.format(
+            mode + ':', traced / 1e6, elapsed, collect))
+
+
+if __name__ == '__main__':
+    main()
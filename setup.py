@@ -17,6 +17,7 @@ setup(
             'start-crawl = sh_scrapy.crawl:main',
             'list-spiders = sh_scrapy.crawl:list_spiders',
             'shub-image-info = sh_scrapy.crawl:shub_image_info',
+            'start-crawl-server = sh_scrapy.worker:main',
         ],
     },
     python_requires='>=3.10',
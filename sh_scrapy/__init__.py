@@ -1,9 +1,23 @@
 __version__ = "0.18.1"
 
 
-from scrapy import version_info as scrapy_version_info
+import os
 
+if os.environ.get('SHUB_STARTUP_TRACE'):
+    # started before any other import, to record import times
+    from sh_scrapy import startup
+    startup.start()
 
-# Flag to check if Scrapy version requires spider argument in some core components.
-# Also indicates whether or not async versions of some methods are supported.
-_SCRAPY_NO_SPIDER_ARG = scrapy_version_info >= (2, 14, 0)
+
+def __getattr__(name):
+    # Scrapy is imported on first use, so that importing the entry points
+    # in sh_scrapy.crawl doesn't import it.
+    if name == 'scrapy_version_info':
+        from scrapy import version_info as scrapy_version_info
+        return scrapy_version_info
+    if name == '_SCRAPY_NO_SPIDER_ARG':
+        # Flag to check if Scrapy version requires spider argument in some core components.
+        # Also indicates whether or not async versions of some methods are supported.
+        value = globals()[name] = __getattr__('scrapy_version_info') >= (2, 14, 0)
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
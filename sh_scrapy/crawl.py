@@ -2,7 +2,7 @@
 # --------------------- DO NOT ADD IMPORTS HERE -------------------------
 # Add them below so that any import errors are caught and sent to sentry
 # -----------------------------------------------------------------------
-from __future__ import print_function
+from __future__ import annotations, print_function
 import datetime
 import logging
 import os
@@ -11,9 +11,8 @@ import sys
 import sysconfig
 import warnings
 from contextlib import contextmanager
-from importlib.metadata import PathDistribution
 from pathlib import Path
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple
 
 # XXX: Do not use atexit to close Hubstorage client!
 # why: functions registed with atexit are called when run_script() finishes,
@@ -21,6 +20,10 @@ from typing import Tuple
 # messages.
 
 from sh_scrapy.exceptions import SHScrapyDeprecationWarning
+from sh_scrapy.startup import phase
+
+if TYPE_CHECKING:
+    from importlib.metadata import PathDistribution
 
 # Keep a reference to standard output/error as they are redirected
 # at log initialization
@@ -48,6 +51,10 @@ https://setuptools.readthedocs.io/en/latest/pkg_resources.html#entry-points
 """
 
 
+# pyc flags of a hash-based pyc file checked against the source
+_PYC_CHECKED_HASH_FLAGS = (0b11).to_bytes(4, 'little')
+
+
 @contextmanager
 def ignore_warnings(**kwargs):
     """Context manager that creates a temporary filter to ignore warnings.
@@ -138,11 +145,10 @@ def _run_pkgscript(argv):
 
     def get_distribution():
         if has_importlib:
-            eps = importlib.metadata.entry_points(group='scrapy')
-        else:
-            eps = pkg_resources.WorkingSet().iter_entry_points('scrapy')
+            from sh_scrapy.entrypoints import find_distribution
+            return find_distribution('scrapy', 'settings')
 
-        for ep in eps:
+        for ep in pkg_resources.WorkingSet().iter_entry_points('scrapy'):
             if ep.name == 'settings':
                 return ep.dist
 
@@ -188,17 +194,56 @@ def _run_script(dist: PathDistribution, script_name: str, namespace: dict) -> No
         raise ValueError(
             f"Script {script_name!r} not found in metadata at {dist._path!r}"
         )
-    code = compile(source, str(script_filename), "exec")
+    code = _compile_script(source, str(script_filename))
     exec(code, namespace, namespace)
 
 
+def _compile_script(source: str, filename: str):
+    """Compile a script, caching its code object in a checked hash-based pyc
+    file (PEP 552) at the path given by importlib.util.cache_from_source(),
+    which honours PYTHONPYCACHEPREFIX, e.g. for read-only site-packages.
+    """
+    import importlib.util
+    import marshal
+
+    try:
+        cache_path = importlib.util.cache_from_source(filename)
+    except (NotImplementedError, ValueError):
+        return compile(source, filename, "exec")
+    header = (importlib.util.MAGIC_NUMBER + _PYC_CHECKED_HASH_FLAGS
+              + importlib.util.source_hash(source.encode('utf-8')))
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        if data.startswith(header):
+            return marshal.loads(data[len(header):])
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    code = compile(source, filename, "exec")
+    if sys.dont_write_bytecode:
+        return code
+    tmp_path = '{}.{}'.format(cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(header + marshal.dumps(code))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # e.g. read-only directory, the script runs uncached
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+    return code
+
+
 def _run_usercode(spider, args, apisettings_func,
                   log_handler=None, commands_module=None):
     try:
         from scrapy.exceptions import ScrapyDeprecationWarning
         from sh_scrapy.settings import populate_settings
 
-        with warnings.catch_warnings():
+        with warnings.catch_warnings(), phase('settings'):
             warnings.filterwarnings("ignore", category=ScrapyDeprecationWarning)
             settings = populate_settings(apisettings_func(), spider)
         if commands_module:
@@ -221,17 +266,19 @@ def _launch():
         from scrapy.exceptions import ScrapyDeprecationWarning
         warnings.filterwarnings(
             'ignore', category=ScrapyDeprecationWarning, module='^sh_scrapy')
-        from sh_scrapy.env import get_args_and_env, decode_uri
-        job = decode_uri(envvar='SHUB_JOB_DATA')
-        assert job, 'SHUB_JOB_DATA must be set'
-        args, env = get_args_and_env(job)
-        os.environ.update(env)
-
-        from sh_scrapy.log import initialize_logging
-        from sh_scrapy.settings import populate_settings  # NOQA
-        from sh_scrapy.env import setup_environment
-        loghdlr = initialize_logging()
-        setup_environment()
+        with phase('job_decode'):
+            from sh_scrapy.env import get_args_and_env, decode_uri
+            job = decode_uri(envvar='SHUB_JOB_DATA')
+            assert job, 'SHUB_JOB_DATA must be set'
+            args, env = get_args_and_env(job)
+            os.environ.update(env)
+
+        with phase('logging_init'):
+            from sh_scrapy.log import initialize_logging
+            from sh_scrapy.settings import populate_settings  # NOQA
+            from sh_scrapy.env import setup_environment
+            loghdlr = initialize_logging()
+            setup_environment()
     except:
         _fatalerror()
         raise
@@ -281,8 +328,9 @@ def shub_image_info():
 
 def main():
     try:
-        from sh_scrapy.writer import pipe_writer
-        pipe_writer.open()
+        with phase('pipe_open'):
+            from sh_scrapy.writer import pipe_writer
+            pipe_writer.open()
     except Exception:
         _fatalerror()
         return 1
@@ -0,0 +1,140 @@
+"""
+Item deduplication filter.
+The goal is to avoid writing and storing the same item several times when a
+spider yields it via different paths: item keys are checked against a Bloom
+filter whose memory usage is fixed by its capacity and false positive rate.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+
+from scrapy.crawler import Crawler
+from scrapy.utils.job import job_dir
+
+from sh_scrapy.writer import jsondefault
+
+
+logger = logging.getLogger(__name__)
+
+DEDUP_STATE_FILENAME = 'items.bloom'
+_HEADER = struct.Struct('<QQQ')
+
+
+class BloomFilter:
+    """Bloom filter sized for capacity keys with the given false positive
+    rate, using double hashing of a 128-bit blake2b digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes) -> list[int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: bytes) -> bool:
+        """Add key to the filter, return True if it was (probably) there."""
+        bits = self.bits
+        found = True
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                found = False
+        if not found:
+            self.count += 1
+        return found
+
+    def dump(self, path: str) -> None:
+        # write atomically so that a crash doesn't leave a truncated filter
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_HEADER.pack(self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path: str) -> bool:
+        """Load a filter dumped with the same size, return True on success."""
+        with open(path, 'rb') as f:
+            num_bits, num_hashes, count = _HEADER.unpack(f.read(_HEADER.size))
+            if (num_bits, num_hashes) != (self.num_bits, self.num_hashes):
+                return False
+            bits = f.read()
+        if len(bits) != len(self.bits):
+            return False
+        self.bits[:] = bits
+        self.count = count
+        return True
+
+
+class ItemDeduplicator:
+    """Drop items whose ITEM_DEDUP_FIELDS values were already written.
+
+    Keys hold the item ``_type`` and the ITEM_DEDUP_FIELDS values. Items
+    without any of these fields have no key and are never duplicates. Keys
+    are added with add() once items are written, so that items dropped for
+    other reasons don't make later copies duplicates.
+
+    The filter holds ITEM_DEDUP_CAPACITY keys with a false positive rate of
+    ITEM_DEDUP_ERROR_RATE, above that capacity the rate of unique items
+    wrongly dropped increases. When JOBDIR is set, the filter is saved there
+    when the spider is closed and restored by resumed jobs.
+    """
+
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.fields = settings.getlist('ITEM_DEDUP_FIELDS')
+        self.capacity = settings.getint('ITEM_DEDUP_CAPACITY', 1000000)
+        self.filter = BloomFilter(self.capacity, settings.getfloat('ITEM_DEDUP_ERROR_RATE', 0.001))
+        self._full = False
+        self._jobdir = job_dir(settings)
+        if self._jobdir:
+            self._load()
+
+    def _load(self) -> None:
+        path = os.path.join(self._jobdir, DEDUP_STATE_FILENAME)
+        if not os.path.exists(path):
+            return
+        if not self.filter.load(path):
+            logger.warning("Ignoring item dedup filter in %s: ITEM_DEDUP_CAPACITY "
+                           "or ITEM_DEDUP_ERROR_RATE changed", path)
+
+    def close(self) -> None:
+        self.stats.set_value('item_dedup/keys', self.filter.count)
+        if self._jobdir:
+            self.filter.dump(os.path.join(self._jobdir, DEDUP_STATE_FILENAME))
+
+    def get_key(self, item: dict) -> bytes | None:
+        if not any(field in item for field in self.fields):
+            return None
+        return json.dumps([item.get('_type'), [item.get(field) for field in self.fields]],
+                          default=jsondefault, sort_keys=True).encode()
+
+    def is_duplicate(self, key: bytes | None) -> bool:
+        if key is None or key not in self.filter:
+            return False
+        self.stats.inc_value('item_dedup/dropped')
+        return True
+
+    def add(self, key: bytes | None) -> None:
+        """Record the key of a written item."""
+        if key is None or self.filter.add(key):
+            return
+        if not self._full and self.filter.count > self.capacity:
+            self._full = True
+            logger.warning("Item dedup filter is over its capacity of %d keys, "
+                           "unique items may be dropped", self.capacity)
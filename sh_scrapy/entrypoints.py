@@ -0,0 +1,109 @@
+"""
+Entry point lookup cache.
+The goal is to find the project distribution of script jobs without reading
+the metadata of every installed distribution: the distribution providing an
+entry point is recorded in the SHUB_ENTRY_POINTS_CACHE_DIR directory, under
+a key hashing the list of installed distributions.
+"""
+
+# Only the standard library is imported here, see sh_scrapy.crawl.
+from __future__ import annotations
+
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENVVAR = 'SHUB_ENTRY_POINTS_CACHE_DIR'
+# Entries of sys.path directories naming installed distributions.
+DISTRIBUTION_SUFFIXES = ('.dist-info', '.egg-info', '.egg', '.pth')
+
+
+def installed_distributions() -> list:
+    """Return the distributions found in sys.path, which include their
+    version in their name, or the stats of sys.path archives."""
+    distributions = []
+    for path in sys.path:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            distributions.append([path, stat.st_size, stat.st_mtime_ns])
+            continue
+        try:
+            names = os.listdir(path or '.')
+        except OSError:
+            continue
+        distributions.append([path, sorted(name for name in names if name.endswith(DISTRIBUTION_SUFFIXES))])
+    return distributions
+
+
+def _get_key(group: str, name: str) -> str:
+    data = [sys.version, group, name, installed_distributions()]
+    return hashlib.sha256(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+def _entry_points_stat(metadata_path: str) -> list:
+    stat = os.stat(os.path.join(metadata_path, 'entry_points.txt'))
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _scan(group: str, name: str) -> importlib.metadata.Distribution | None:
+    for ep in importlib.metadata.entry_points(group=group):
+        if ep.name == name:
+            return ep.dist
+    return None
+
+
+def _load(path: str) -> importlib.metadata.Distribution | None:
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        metadata_path = entry['metadata']
+        if _entry_points_stat(metadata_path) == entry['entry_points']:
+            return importlib.metadata.PathDistribution(Path(metadata_path))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring invalid entry point cache entry %s: %s", path, e)
+    return None
+
+
+def _store(path: str, dist: importlib.metadata.Distribution) -> None:
+    if not isinstance(dist, importlib.metadata.PathDistribution):
+        return
+    metadata_path = str(dist._path)
+    directory = os.path.dirname(path)
+    try:
+        entry = {'metadata': metadata_path, 'entry_points': _entry_points_stat(metadata_path)}
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Failed to write entry point cache entry in %s: %s", directory, e)
+
+
+def find_distribution(group: str, name: str) -> importlib.metadata.Distribution | None:
+    """Return the distribution providing an entry point, or None.
+
+    When SHUB_ENTRY_POINTS_CACHE_DIR is set, the result is cached there until
+    a distribution is installed or removed, or the entry points of the found
+    one change.
+    """
+    directory = os.environ.get(CACHE_DIR_ENVVAR)
+    if not directory:
+        return _scan(group, name)
+    path = os.path.join(directory, 'entry-point-{}.json'.format(_get_key(group, name)))
+    dist = _load(path)
+    if dist is None:
+        dist = _scan(group, name)
+        if dist is not None:
+            _store(path, dist)
+    return dist
@@ -1,10 +1,23 @@
 import os
 import json
 import codecs
+import gzip
+import mmap
 from base64 import b64decode
 
 from scrapy.utils.python import to_bytes, to_unicode
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Decoded data: URIs by URI, as (MIME type, parameters, payload). Payloads
+# are bytes, decoding them again for every call returns new objects.
+_data_uris = {}
+_DATA_URIS_MAX = 8
+
 
 def _make_scrapy_args(arg, args_dict):
     if not args_dict:
@@ -70,13 +83,96 @@ def get_args_and_env(msg):
     return args, env
 
 
+def _json_loads(data):
+    """Parse JSON from str, bytes or a memoryview, with orjson if installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN or integers over 64 bits, which json supports
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def _zstd_decompress(data):
+    try:
+        from compression import zstd  # Python 3.14+
+    except ImportError:
+        pass
+    else:
+        return zstd.decompress(data)
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd encoding requires Python 3.14+ or the zstandard package')
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+_DECOMPRESSORS = {
+    'gzip': gzip.decompress,
+    'zstd': _zstd_decompress,
+}
+
+
+def _decode_data_uri(uri):
+    # data:[<MIME-type>][;charset=<encoding>][;encoding=<gzip|zstd>][;base64],<data>
+    decoded = _data_uris.get(uri)
+    if decoded is not None:
+        return decoded
+    mime_type = 'application/json'
+    prefix, _, data = uri.rpartition(',')
+    mods = {}
+    for idx, value in enumerate(prefix[5:].split(';')):
+        if idx == 0:
+            mime_type = value or mime_type
+        elif '=' in value:
+            k, _, v = value.partition('=')
+            mods[k] = v
+        else:
+            mods[value] = None
+
+    if 'base64' in mods:
+        data = b64decode(data)
+    encoding = mods.get('encoding')
+    if encoding is not None:
+        if encoding not in _DECOMPRESSORS:
+            raise ValueError('Unsupported data: URI encoding: {!r}'.format(encoding))
+        if 'base64' not in mods:
+            raise ValueError('Compressed data: URIs must be base64-encoded')
+        data = _DECOMPRESSORS[encoding](data)
+    if len(_data_uris) >= _DATA_URIS_MAX:
+        _data_uris.clear()
+    decoded = _data_uris[uri] = (mime_type, mods, data)
+    return decoded
+
+
+def _load_json_file(path):
+    with open(path, 'rb') as data_file:
+        try:
+            data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return _json_loads(data_file.read())
+    with data, memoryview(data) as view:
+        return _json_loads(view)
+
+
 def decode_uri(uri=None, envvar=None):
     """Return content for a data: or file: URI
 
+    Decoded data: URIs are kept for later calls with the same URI, and JSON
+    is parsed with orjson when it is installed. Base64 data: URIs can be
+    compressed with ``;encoding=gzip`` or ``;encoding=zstd``, the latter
+    requiring Python 3.14+ or the zstandard package.
+
     >>> decode_uri('data:application/json;charset=utf8;base64,ImhlbGxvIHdvcmxkIg==')
     u'hello world'
     >>> decode_uri('data:;base64,ImhlbGxvIHdvcmxkIg==')
     u'hello world'
+    >>> decode_uri('data:;encoding=gzip;base64,H4sIAAAAAAACA1PKSM3JyVcozy/KSVECAITtPj0NAAAA')
+    u'hello world'
     >>> decode_uri('{"spider": "hello"}')
     {u'spider': u'hello'}
 
@@ -86,38 +182,23 @@ def decode_uri(uri=None, envvar=None):
     elif uri is None:
         raise ValueError('An uri or envvar is required')
 
-    mime_type = 'application/json'
-
-    # data:[<MIME-type>][;charset=<encoding>][;base64],<data>
     if uri.startswith('data:'):
-        prefix, _, data = uri.rpartition(',')
-        mods = {}
-        for idx, value in enumerate(prefix[5:].split(';')):
-            if idx == 0:
-                mime_type = value or mime_type
-            elif '=' in value:
-                k, _, v = value.partition('=')
-                mods[k] = v
-            else:
-                mods[value] = None
-
-        if 'base64' in mods:
-            data = b64decode(data)
+        mime_type, mods, data = _decode_data_uri(uri)
         if mime_type == 'application/json':
-            data = data.decode(mods.get('charset', 'utf-8'))
-            return json.loads(data)
+            charset = mods.get('charset', 'utf-8')
+            if codecs.lookup(charset).name != 'utf-8':
+                data = data.decode(charset)
+            return _json_loads(data)
         else:
             return data
 
     if uri.startswith('{'):
-        return json.loads(uri)
+        return _json_loads(uri)
 
     if uri.startswith('/'):
         uri = 'file://' + uri
     if uri.startswith('file://'):
-        reader = codecs.getreader("utf-8")
-        with open(uri[7:], 'rb') as data_file:
-            return json.load(reader(data_file))
+        return _load_json_file(uri[7:])
 
 
 def setup_environment():
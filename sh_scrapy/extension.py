@@ -1,17 +1,24 @@
 import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
 from contextlib import suppress
 from warnings import warn
 from weakref import WeakKeyDictionary
 
 import scrapy
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
 from scrapy import version_info as SCRAPY_VERSION_INFO
-from scrapy.exporters import PythonItemExporter
 from scrapy.http import Request
 from scrapy.utils.deprecate import create_deprecated_class
 
 from sh_scrapy import hsref
+from sh_scrapy.dedup import ItemDeduplicator
 from sh_scrapy.exceptions import SHScrapyDeprecationWarning
+from sh_scrapy.itemsize import ItemSizeGuard
 from sh_scrapy.middlewares import HS_PARENT_ID_KEY, request_id_sequence
 from sh_scrapy.writer import pipe_writer
 
@@ -40,10 +47,18 @@ class HubstorageExtension(object):
         self.crawler = crawler
         self.logger = logging.getLogger(__name__)
         self._write_item = self.pipe_writer.write_item
+        from scrapy.exporters import PythonItemExporter
+
         kwargs = {}
         if SCRAPY_VERSION_INFO < (2, 11):
             kwargs["binary"] = False
         self.exporter = PythonItemExporter(**kwargs)
+        self.deduplicator = None
+        if crawler.settings.getlist('ITEM_DEDUP_FIELDS'):
+            self.deduplicator = ItemDeduplicator(crawler)
+        self.size_guard = None
+        if crawler.settings.getint('ITEM_SIZE_LIMIT'):
+            self.size_guard = ItemSizeGuard(crawler)
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -59,12 +74,125 @@ class HubstorageExtension(object):
         type_ = type(item).__name__
         item = self.exporter.export_item(item)
         item.setdefault("_type", type_)
+        if self.deduplicator is not None:
+            # computed before the size guard, which may change the item
+            dedup_key = self.deduplicator.get_key(item)
+            if self.deduplicator.is_duplicate(dedup_key):
+                return
+        if self.size_guard is not None:
+            item = self.size_guard.process(item)
+            if item is None:
+                return
         self._write_item(item)
+        if self.deduplicator is not None:
+            self.deduplicator.add(dedup_key)
 
     def spider_closed(self, spider, reason):
+        if self.deduplicator is not None:
+            self.deduplicator.close()
         self.pipe_writer.set_outcome(reason)
 
 
+class ReactorLagMonitor(object):
+    """Extension to measure how long the reactor is blocked
+
+    A callback is scheduled every REACTOR_LAG_INTERVAL seconds and the delay
+    between its expected and actual run time is recorded. A watchdog thread
+    logs the reactor thread stack when it is blocked for longer than
+    REACTOR_LAG_STALL_THRESHOLD seconds.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool('REACTOR_LAG_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.logger = logging.getLogger(__name__)
+        self.interval = crawler.settings.getfloat('REACTOR_LAG_INTERVAL', 1.0)
+        self.stall_threshold = crawler.settings.getfloat(
+            'REACTOR_LAG_STALL_THRESHOLD', 5.0)
+        # lag in milliseconds -> number of samples
+        self._lags = Counter()
+        self._call = None
+        self._expected = None
+        self._heartbeat = None
+        self._reported_heartbeat = None
+        # written by the watchdog thread, stored into stats on spider_closed
+        self._stalls = 0
+        self._reactor_thread_id = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_opened, signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider):
+        self._reactor_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._schedule()
+        if self.stall_threshold > 0:
+            watchdog = threading.Thread(
+                target=self._watch, name='ReactorLagWatchdog', daemon=True)
+            watchdog.start()
+
+    def spider_closed(self, spider, reason):
+        self._stopped.set()
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        if self._stalls:
+            self.stats.set_value('reactor_lag/stalls', self._stalls)
+        total = sum(self._lags.values())
+        if not total:
+            return
+        self.stats.set_value('reactor_lag/samples', total)
+        for percentile in self.PERCENTILES:
+            value = _percentile(self._lags, total, percentile)
+            self.stats.set_value('reactor_lag/p%d' % percentile, value / 1000.0)
+
+    def _schedule(self):
+        from twisted.internet import reactor
+        self._expected = time.monotonic() + self.interval
+        self._call = reactor.callLater(self.interval, self._tick)
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = max(now - self._expected, 0)
+        self._heartbeat = now
+        self._lags[round(lag * 1000)] += 1
+        self.stats.max_value('reactor_lag/max', round(lag, 3))
+        self._schedule()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            self._check_stall()
+
+    def _check_stall(self):
+        blocked = time.monotonic() - self._heartbeat - self.interval
+        # report every stall only once
+        if blocked < self.stall_threshold or self._reported_heartbeat == self._heartbeat:
+            return
+        self._reported_heartbeat = self._heartbeat
+        self._stalls += 1
+        frame = sys._current_frames().get(self._reactor_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else ''
+        self.logger.warning(
+            "Reactor blocked for %.1fs, reactor thread stack:\n%s", blocked, stack)
+
+
+def _percentile(counts, total, percentile):
+    threshold = total * percentile / 100.0
+    seen = 0
+    for value in sorted(counts):
+        seen += counts[value]
+        if seen >= threshold:
+            return value
+
+
 _HUBSTORAGE_MIDDLEWARE_WARNING = """\
 {cls} inherits from deprecated class {old}
 
@@ -4,8 +4,6 @@ Module to hold a reference to singleton Hubstorage client and Job instance
 import os
 from codecs import decode
 
-from scrapy.utils.python import to_unicode
-
 
 class _HubstorageRef(object):
 
@@ -25,7 +23,7 @@ class _HubstorageRef(object):
 
     @property
     def auth(self):
-        return to_unicode(decode(os.environ['SHUB_JOBAUTH'], 'hex_codec'))
+        return decode(os.environ['SHUB_JOBAUTH'], 'hex_codec').decode('utf-8')
 
     @property
     def endpoint(self):
@@ -0,0 +1,128 @@
+"""
+Item size guard.
+The goal is to catch oversized items before they are encoded and written to
+Hubstorage: encoding a huge item blocks the reactor and the item can be
+rejected downstream anyway.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import uuid
+from typing import Any
+
+from scrapy.crawler import Crawler
+
+from sh_scrapy.settings import get_setting_choice
+from sh_scrapy.writer import jsondefault
+
+
+logger = logging.getLogger(__name__)
+
+# What to do with items bigger than ITEM_SIZE_LIMIT:
+# - drop: log and drop the item.
+# - truncate: truncate the string values of big fields.
+# - offload: write big fields to local files referenced from the item.
+# Items still too big after truncating or offloading are dropped.
+ITEM_SIZE_POLICIES = ('drop', 'truncate', 'offload')
+OFFLOADED_KEY = '_offloaded'
+
+
+def estimate_size(obj: Any, limit: int | None = None) -> int:
+    """Return a cheap estimate of the JSON-encoded size of obj.
+
+    The estimate stops as soon as it exceeds limit, if one is given.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, (str, bytes)):
+            size += len(obj) + 2
+        elif isinstance(obj, dict):
+            size += 1 + 2 * len(obj)
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            size += 1 + len(obj)
+            stack.extend(obj)
+        else:
+            size += 8
+        if limit is not None and size > limit:
+            break
+    return size
+
+
+class ItemSizeGuard:
+    """Apply ITEM_SIZE_POLICY to items bigger than ITEM_SIZE_LIMIT bytes.
+
+    Truncating and offloading apply to the ITEM_SIZE_FIELDS fields, or to
+    every field bigger than ITEM_SIZE_FIELD_LIMIT bytes if none is set.
+    """
+
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.limit = settings.getint('ITEM_SIZE_LIMIT')
+        self.policy = get_setting_choice(crawler, 'ITEM_SIZE_POLICY', ITEM_SIZE_POLICIES)
+        self.fields = settings.getlist('ITEM_SIZE_FIELDS')
+        self.field_limit = settings.getint('ITEM_SIZE_FIELD_LIMIT', 1024 * 1024)
+        self.offload_dir = settings.get('ITEM_SIZE_OFFLOAD_DIR') or os.path.join(
+            settings.get('JOBDIR') or tempfile.gettempdir(), 'offloaded_items')
+
+    def process(self, item: dict) -> dict | None:
+        """Return the item to write, or None if it must be dropped."""
+        if estimate_size(item, self.limit) <= self.limit:
+            return item
+        self.stats.inc_value('item_size/oversized')
+        if self.policy == 'truncate':
+            self._truncate(item)
+        elif self.policy == 'offload':
+            self._offload(item)
+        size = estimate_size(item)
+        if self.policy != 'drop' and size <= self.limit:
+            return item
+        self.stats.inc_value('item_size/dropped')
+        self.stats.inc_value('item_size/dropped_bytes', size)
+        logger.warning(
+            "Dropped %s item bigger than ITEM_SIZE_LIMIT: %d > %d bytes",
+            item.get('_type'), size, self.limit)
+        return None
+
+    def _big_fields(self, item: dict) -> list[str]:
+        if self.fields:
+            return [field for field in self.fields if field in item]
+        return [field for field, value in item.items()
+                if estimate_size(value, self.field_limit) > self.field_limit]
+
+    def _truncate(self, item: dict) -> None:
+        for field in self._big_fields(item):
+            value = item[field]
+            if isinstance(value, str):
+                encoded = value.encode('utf-8')
+                # cut at a character boundary
+                truncated = encoded[:self.field_limit].decode('utf-8', 'ignore')
+                size, new_size = len(encoded), len(truncated.encode('utf-8'))
+            elif isinstance(value, bytes):
+                truncated = value[:self.field_limit]
+                size, new_size = len(value), len(truncated)
+            else:
+                continue
+            if size > self.field_limit:
+                item[field] = truncated
+                self.stats.inc_value('item_size/truncated')
+                self.stats.inc_value('item_size/truncated_bytes', size - new_size)
+
+    def _offload(self, item: dict) -> None:
+        os.makedirs(self.offload_dir, exist_ok=True)
+        for field in self._big_fields(item):
+            path = os.path.join(self.offload_dir, '{}.json'.format(uuid.uuid4().hex))
+            with open(path, 'w') as f:
+                json.dump(item[field], f, default=jsondefault)
+                size = f.tell()
+            item[field] = {OFFLOADED_KEY: path, 'size': size}
+            self.stats.inc_value('item_size/offloaded')
+            self.stats.inc_value('item_size/offloaded_bytes', size)
@@ -0,0 +1,94 @@
+"""
+Request lineage extension.
+The goal is to analyse crawl trees without querying the stored requests: the
+parent and depth of every request stored by HubstorageDownloaderMiddleware
+are kept in compact arrays, summarized in stats and optionally exported as a
+gzip-compressed CSV file at the end of the job.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+from array import array
+from collections import Counter
+
+from scrapy import Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+
+
+logger = logging.getLogger(__name__)
+
+NO_PARENT = -1
+
+
+class RequestLineage:
+    """Extension that keeps the parent and the depth of every stored request.
+
+    Requests are indexed by their Hubstorage request id, using 12 bytes per
+    request. Requests without a parent, or whose parent was stored by another
+    process, have a depth of 0.
+    """
+
+    def __init__(self, crawler: Crawler):
+        if not crawler.settings.getbool('LINEAGE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.output_file = crawler.settings.get('LINEAGE_OUTPUT_FILE')
+        self.first_id = None
+        self.parents = array('q')
+        self.depths = array('I')
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> RequestLineage:
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_closed, signals.spider_closed)
+        return o
+
+    def add(self, request_id: int, parent: int | None) -> None:
+        if self.first_id is None:
+            self.first_id = request_id
+        index = request_id - self.first_id
+        while len(self.parents) < index:
+            # fill the gaps left by ids not seen by this process
+            self.parents.append(NO_PARENT)
+            self.depths.append(0)
+        depth = 0
+        if parent is not None and 0 <= parent - self.first_id < len(self.depths):
+            depth = self.depths[parent - self.first_id] + 1
+        self.parents.append(NO_PARENT if parent is None else parent)
+        self.depths.append(depth)
+
+    def depth_distribution(self) -> Counter[int]:
+        return Counter(self.depths)
+
+    def spider_closed(self, spider: Spider, reason: str) -> None:
+        stats = self.crawler.stats
+        stats.set_value('lineage/requests', len(self.parents))
+        for depth, count in sorted(self.depth_distribution().items()):
+            stats.set_value('lineage/depth/{}'.format(depth), count)
+        if self.depths:
+            stats.set_value('lineage/max_depth', max(self.depths))
+        if self.output_file:
+            self.export(self.output_file)
+            logger.info("Request lineage written to %s", self.output_file)
+
+    def export(self, path: str) -> None:
+        """Write the lineage as a gzip-compressed ``id,parent,depth`` CSV,
+        with an empty parent for requests without one."""
+        first_id = self.first_id or 0
+        with gzip.open(path, 'wt') as f:
+            f.write('id,parent,depth\n')
+            for index, (parent, depth) in enumerate(zip(self.parents, self.depths)):
+                f.write('{},{},{}\n'.format(
+                    first_id + index, '' if parent == NO_PARENT else parent, depth))
+
+
+def get_lineage(crawler: Crawler) -> RequestLineage | None:
+    """Return the enabled RequestLineage extension of crawler, if any."""
+    extensions = getattr(crawler, 'extensions', None)
+    for extension in getattr(extensions, 'middlewares', ()):
+        if isinstance(extension, RequestLineage):
+            return extension
+    return None
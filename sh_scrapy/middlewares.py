@@ -2,24 +2,84 @@
 from __future__ import annotations
 
 import itertools
+import json
+import os
+import random
 from typing import AsyncIterable, AsyncGenerator, Iterable
 from warnings import warn
 from weakref import WeakKeyDictionary
 
-from scrapy import Spider
+from scrapy import Spider, signals
 from scrapy.crawler import Crawler
 from scrapy.http import Request, Response
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.job import job_dir
 
 from sh_scrapy import _SCRAPY_NO_SPIDER_ARG
+from sh_scrapy.lineage import get_lineage
+from sh_scrapy.settings import get_setting_choice
 from sh_scrapy.writer import pipe_writer
 
 
 HS_REQUEST_ID_KEY = '_hsid'
 HS_PARENT_ID_KEY = '_hsparent'
+# id() of the request HS_REQUEST_ID_KEY was set for, in the meta tracking mode
+HS_REQUEST_OBJ_KEY = '_hsidobj'
+HS_RESPONSE_SIZE_KEY = '_hsrs'
+HS_STATE_FILENAME = 'hubstorage.state'
+# How request ids are passed from the downloader to the spider:
+# - weakref: in the module-global seen_requests mapping.
+# - meta: only in the request meta, which avoids a weak reference per
+#   in-flight request and its cleanup on garbage collection. Ids in meta
+#   copied to other requests, e.g. with Request.replace(), are ignored.
+REQUEST_TRACKING_MODES = ('weakref', 'meta')
+# Where the size of downloaded responses is taken from:
+# - body: the length of the response body.
+# - headers: the Content-Length header, or the body if the header is missing.
+# - meta: the HS_RESPONSE_SIZE_KEY meta key, which can be set by download
+#   handlers, or the Content-Length header. The body is never accessed.
+RESPONSE_SIZE_MODES = ('body', 'headers', 'meta')
 request_id_sequence = itertools.count()
 seen_requests = WeakKeyDictionary()
 
 
+def _get_request_tracking(crawler: Crawler | None) -> str:
+    return get_setting_choice(crawler, 'HUBSTORAGE_REQUEST_TRACKING', REQUEST_TRACKING_MODES)
+
+
+def _get_content_length(response: Response) -> int | None:
+    content_length = response.headers.get(b'Content-Length')
+    if content_length is None:
+        return None
+    try:
+        return int(content_length)
+    except ValueError:
+        return None
+
+
+def _response_size_from_body(request: Request, response: Response) -> int:
+    return len(response.body)
+
+
+def _response_size_from_headers(request: Request, response: Response) -> int:
+    size = _get_content_length(response)
+    return len(response.body) if size is None else size
+
+
+def _response_size_from_meta(request: Request, response: Response) -> int:
+    size = request.meta.get(HS_RESPONSE_SIZE_KEY)
+    if size is None:
+        size = _get_content_length(response)
+    return size or 0
+
+
+_RESPONSE_SIZE_FUNCS = {
+    'body': _response_size_from_body,
+    'headers': _response_size_from_headers,
+    'meta': _response_size_from_meta,
+}
+
+
 class HubstorageSpiderMiddleware:
     """Hubstorage spider middleware.
 
@@ -29,20 +89,19 @@ class HubstorageSpiderMiddleware:
 
     """
 
-    def __init__(self) -> None:
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> HubstorageSpiderMiddleware:
+        return cls(crawler)
+
+    def __init__(self, crawler: Crawler | None = None) -> None:
         self._seen_requests = seen_requests
+        self._track_in_meta = _get_request_tracking(crawler) == 'meta'
 
     if _SCRAPY_NO_SPIDER_ARG:
 
         def process_spider_output(self, response: Response, result: Iterable) -> Iterable:
             return self._process_spider_output(response, result)
 
-        async def process_spider_output_async(
-            self, response: Response, result: Iterable
-        ) -> AsyncGenerator:
-            async for x in self._process_spider_output_async(response, result):
-                yield x
-
     else:
 
         def process_spider_output(
@@ -50,24 +109,33 @@ class HubstorageSpiderMiddleware:
         ) -> Iterable:
             return self._process_spider_output(response, result)
 
-        async def process_spider_output_async(
-            self, response: Response, result: Iterable, spider: Spider
-        ) -> AsyncGenerator:
-            async for x in self._process_spider_output_async(response, result):
-                yield x
-
-    def _process_spider_output(self, response: Response, result: Iterable) -> Iterable:
-        parent = self._seen_requests.pop(response.request, None)
-        for x in result:
+    # Not wrapping a private async generator saves a generator layer per
+    # output object, and the optional spider argument fits all Scrapy versions.
+    async def process_spider_output_async(
+        self, response: Response, result: AsyncIterable, spider: Spider | None = None
+    ) -> AsyncGenerator:
+        parent = self._get_parent(response)
+        async for x in result:
             if isinstance(x, Request):
-                self._process_request(x, parent)
+                meta = x.meta
+                meta[HS_PARENT_ID_KEY] = parent
+                meta.pop(HS_REQUEST_ID_KEY, None)
+                meta.pop(HS_REQUEST_OBJ_KEY, None)
             yield x
 
-    async def _process_spider_output_async(
-        self, response: Response, result: AsyncIterable
-    ) -> AsyncGenerator:
-        parent = self._seen_requests.pop(response.request, None)
-        async for x in result:
+    def _get_parent(self, response: Response) -> int | None:
+        if self._track_in_meta:
+            request = response.request
+            meta = request.meta
+            # the id may have been set for another request the meta was copied from
+            if meta.get(HS_REQUEST_OBJ_KEY) != id(request):
+                return None
+            return meta.get(HS_REQUEST_ID_KEY)
+        return self._seen_requests.pop(response.request, None)
+
+    def _process_spider_output(self, response: Response, result: Iterable) -> Iterable:
+        parent = self._get_parent(response)
+        for x in result:
             if isinstance(x, Request):
                 self._process_request(x, parent)
             yield x
@@ -76,6 +144,7 @@ class HubstorageSpiderMiddleware:
         request.meta[HS_PARENT_ID_KEY] = parent
         # Remove request id if it was for some reason set in the request coming from Spider.
         request.meta.pop(HS_REQUEST_ID_KEY, None)
+        request.meta.pop(HS_REQUEST_OBJ_KEY, None)
 
 
 class HubstorageDownloaderMiddleware:
@@ -85,7 +154,11 @@ class HubstorageDownloaderMiddleware:
 
     - Generates request ids for all downloaded requests.
     - Sets parent request ids for requests generated in downloader middlewares.
-    - Stores all downloaded requests into Hubstorage.
+    - Stores all downloaded requests into Hubstorage, or only a sample of the
+      successful ones when HUBSTORAGE_REQUEST_SAMPLE_RATE is lower than 1.
+    - Persists the request id sequence in JOBDIR, so that resumed jobs don't
+      reuse request ids. Parent ids of pending requests are persisted with
+      their meta by the scheduler.
 
     """
 
@@ -104,7 +177,7 @@ class HubstorageDownloaderMiddleware:
             )
             result = cls()
             result._crawler = crawler
-            result._load_fingerprinter()
+            result._load_settings()
         return result
 
     def __init__(self, crawler: Crawler):
@@ -112,11 +185,56 @@ class HubstorageDownloaderMiddleware:
         self._seen_requests = seen_requests
         self.pipe_writer = pipe_writer
         self.request_id_sequence = request_id_sequence
+        self._load_settings()
+
+    def _load_settings(self) -> None:
+        self._track_in_meta = _get_request_tracking(self._crawler) == 'meta'
+        self._lineage = get_lineage(self._crawler)
+        self._load_response_size()
         self._load_fingerprinter()
+        self._load_sampling()
+        self._load_state()
+
+    def _load_state(self) -> None:
+        self._next_request_id = None
+        self._jobdir = job_dir(self._crawler.settings)
+        if not self._jobdir:
+            return
+        self._crawler.signals.connect(self.spider_closed, signals.spider_closed)
+        statefn = os.path.join(self._jobdir, HS_STATE_FILENAME)
+        if not os.path.exists(statefn):
+            return
+        with open(statefn) as f:
+            self._next_request_id = json.load(f)['next_request_id']
+        self.request_id_sequence = itertools.count(self._next_request_id)
+
+    def spider_closed(self, spider: Spider) -> None:
+        if self._next_request_id is None:
+            return
+        statefn = os.path.join(self._jobdir, HS_STATE_FILENAME)
+        # write atomically so that a crash doesn't leave a truncated state
+        with open(statefn + '.tmp', 'w') as f:
+            json.dump({'next_request_id': self._next_request_id}, f)
+        os.replace(statefn + '.tmp', statefn)
+
+    def _load_sampling(self) -> None:
+        settings = self._crawler.settings
+        self._sample_rate = settings.getfloat('HUBSTORAGE_REQUEST_SAMPLE_RATE', 1.0)
+        self._max_dropped_domains = settings.getint('HUBSTORAGE_REQUEST_DROPPED_DOMAINS_MAX', 100)
+        self._dropped_domains = set()
+
+    def _load_response_size(self) -> None:
+        mode = get_setting_choice(self._crawler, 'HUBSTORAGE_RESPONSE_SIZE', RESPONSE_SIZE_MODES)
+        self._response_size = _RESPONSE_SIZE_FUNCS[mode]
 
     def _load_fingerprinter(self) -> None:
-        if hasattr(self._crawler, "request_fingerprinter"):
-            self._fingerprint = lambda request: self._crawler.request_fingerprinter.fingerprint(request).hex()
+        if not self._crawler.settings.getbool('HUBSTORAGE_REQUEST_FINGERPRINT', True):
+            self._fingerprint = lambda request: None
+        elif hasattr(self._crawler, "request_fingerprinter"):
+            # The default fingerprinter caches fingerprints per request, so
+            # requests already seen by the dupefilter are not hashed again.
+            fingerprint = self._crawler.request_fingerprinter.fingerprint
+            self._fingerprint = lambda request: fingerprint(request).hex()
         else:
             from scrapy.utils.request import request_fingerprint
             self._fingerprint = request_fingerprint
@@ -141,6 +259,7 @@ class HubstorageDownloaderMiddleware:
         # Check if request id is set, which usually happens for retries or redirects because
         # those requests are usually copied from the original one.
         request_id = request.meta.pop(HS_REQUEST_ID_KEY, None)
+        request.meta.pop(HS_REQUEST_OBJ_KEY, None)
         if request_id is not None:
             # Set original request id or None as a parent request id.
             request.meta[HS_PARENT_ID_KEY] = request_id
@@ -151,17 +270,51 @@ class HubstorageDownloaderMiddleware:
         if type(response).__name__ == "DummyResponse" and type(response).__module__.startswith("scrapy_poet"):
             return response
 
-        self.pipe_writer.write_request(
-            url=response.url,
-            status=response.status,
-            method=request.method,
-            rs=len(response.body),
-            duration=request.meta.get('download_latency', 0) * 1000,
-            parent=request.meta.setdefault(HS_PARENT_ID_KEY),
-            fp=self._fingerprint(request),
-        )
-        # Generate and set request id.
-        request_id = next(self.request_id_sequence)
-        self._seen_requests[request] = request_id
+        parent = request.meta.setdefault(HS_PARENT_ID_KEY)
+        if (self._sample_rate < 1 and self._is_routine(request, response)
+                and random.random() >= self._sample_rate):
+            # Request ids are positions in the stored requests, so a dropped
+            # request doesn't get one: its children are linked to its parent.
+            self._record_dropped(request, response)
+            request_id = parent
+        else:
+            self.pipe_writer.write_request(
+                url=response.url,
+                status=response.status,
+                method=request.method,
+                rs=self._response_size(request, response),
+                duration=request.meta.get('download_latency', 0) * 1000,
+                parent=parent,
+                fp=self._fingerprint(request),
+            )
+            # Generate request id.
+            request_id = next(self.request_id_sequence)
+            self._next_request_id = request_id + 1
+            if self._lineage is not None:
+                self._lineage.add(request_id, parent)
+        if self._track_in_meta:
+            request.meta[HS_REQUEST_OBJ_KEY] = id(request)
+        else:
+            self._seen_requests[request] = request_id
         request.meta[HS_REQUEST_ID_KEY] = request_id
         return response
+
+    @staticmethod
+    def _is_routine(request: Request, response: Response) -> bool:
+        return (200 <= response.status < 300
+                and 'redirect_times' not in request.meta
+                and 'retry_times' not in request.meta)
+
+    def _record_dropped(self, request: Request, response: Response) -> None:
+        stats = self._crawler.stats
+        size = self._response_size(request, response)
+        stats.inc_value('hubstorage/requests_dropped')
+        stats.inc_value('hubstorage/requests_dropped_bytes', size)
+        domain = urlparse_cached(response).hostname or ''
+        if domain not in self._dropped_domains:
+            if len(self._dropped_domains) >= self._max_dropped_domains:
+                domain = 'other'
+            else:
+                self._dropped_domains.add(domain)
+        stats.inc_value('hubstorage/requests_dropped/{}/count'.format(domain))
+        stats.inc_value('hubstorage/requests_dropped/{}/bytes'.format(domain), size)
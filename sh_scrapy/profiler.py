@@ -0,0 +1,98 @@
+"""
+Sampling profiler extension.
+The goal is to find hot paths in spiders running on real traffic with low
+overhead: the main thread stack is sampled on a CPU time interval timer and
+aggregated in memory as collapsed stacks, ready to be rendered as a
+flamegraph.
+"""
+
+from __future__ import annotations
+
+import logging
+import signal
+from collections import Counter
+from types import FrameType
+
+from scrapy import Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+
+
+logger = logging.getLogger(__name__)
+
+OTHER_STACKS = '[other]'
+
+
+def _collapse_stack(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Extension that samples the main thread stack every PROFILER_INTERVAL
+    seconds of CPU time.
+
+    At most PROFILER_MAX_STACKS distinct stacks are kept, further samples
+    are counted under the ``[other]`` stack. On close, the collapsed stacks
+    are written to PROFILER_OUTPUT_FILE, or logged if it is not set.
+    """
+
+    def __init__(self, crawler: Crawler):
+        if not crawler.settings.getbool('PROFILER_ENABLED'):
+            raise NotConfigured
+        if not hasattr(signal, 'setitimer'):
+            raise NotConfigured('SamplingProfiler requires signal.setitimer')
+        self.crawler = crawler
+        self.interval = crawler.settings.getfloat('PROFILER_INTERVAL', 0.01)
+        self.max_stacks = crawler.settings.getint('PROFILER_MAX_STACKS', 10000)
+        self.output_file = crawler.settings.get('PROFILER_OUTPUT_FILE')
+        self.stacks: Counter[str] = Counter()
+        self._previous_handler = None
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> SamplingProfiler:
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_opened, signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider: Spider) -> None:
+        try:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        except ValueError:
+            # signal handlers can only be set from the main thread
+            logger.warning("SamplingProfiler must run in the main thread, profiling disabled")
+            return
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def spider_closed(self, spider: Spider, reason: str) -> None:
+        if self._previous_handler is None:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+        self._previous_handler = None
+        self.crawler.stats.set_value('profiler/samples', sum(self.stacks.values()))
+        self.crawler.stats.set_value('profiler/stacks', len(self.stacks))
+        collapsed = self.format_stacks()
+        if self.output_file:
+            with open(self.output_file, 'w') as f:
+                f.write(collapsed)
+            logger.info("Profile written to %s", self.output_file)
+        else:
+            logger.info("Collapsed profile stacks:\n%s", collapsed)
+
+    def _sample(self, signum: int, frame: FrameType | None) -> None:
+        stack = _collapse_stack(frame)
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+            stack = OTHER_STACKS
+        self.stacks[stack] += 1
+
+    def format_stacks(self) -> str:
+        """Return stacks in the collapsed format understood by flamegraph.pl"""
+        return ''.join(
+            '{} {}\n'.format(stack, count) for stack, count in self.stacks.most_common()
+        )
@@ -0,0 +1,130 @@
+"""
+Item schema statistics extension.
+The goal is to detect broken selectors without scanning stored items: the
+presence and value types of the fields of every scraped item are counted
+per item type, and a summary is stored in stats when the spider is closed.
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import Any
+
+from itemadapter import ItemAdapter
+from scrapy import Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+
+
+VALUE_KINDS = ('str', 'int', 'float', 'bool', 'list', 'dict', 'null', 'other')
+_KIND_INDEX = {kind: index for index, kind in enumerate(VALUE_KINDS)}
+_KIND_BY_TYPE = {
+    str: _KIND_INDEX['str'],
+    bytes: _KIND_INDEX['str'],
+    int: _KIND_INDEX['int'],
+    float: _KIND_INDEX['float'],
+    bool: _KIND_INDEX['bool'],
+    list: _KIND_INDEX['list'],
+    tuple: _KIND_INDEX['list'],
+    dict: _KIND_INDEX['dict'],
+    type(None): _KIND_INDEX['null'],
+}
+# counters of a field: one per value kind, then the number of items with a
+# non-empty value and the number of items with the field
+_FILLED = len(VALUE_KINDS)
+_PRESENT = _FILLED + 1
+OTHER_FIELDS = '[other]'
+
+
+def _kind_index(value: Any) -> int:
+    index = _KIND_BY_TYPE.get(type(value))
+    if index is not None:
+        return index
+    if isinstance(value, dict):
+        return _KIND_INDEX['dict']
+    if isinstance(value, (list, tuple)):
+        return _KIND_INDEX['list']
+    return _KIND_INDEX['other']
+
+
+class ItemSchemaStats:
+    """Extension that counts, per item type, how often each field is present,
+    non-empty and of each value kind.
+
+    The item type is the ``_type`` of items that have one, as stored by
+    HubstorageExtension, or their class name otherwise.
+
+    Items are not retained: every field uses a fixed number of counters, and
+    at most SCHEMA_STATS_MAX_FIELDS fields are tracked per item type, further
+    fields being counted under ``[other]`` as if they were one field. On
+    close, the following stats are set for each item type and field:
+
+    - ``schema/<type>/items``: the number of items.
+    - ``schema/<type>/<field>/presence``: the ratio of items with the field.
+    - ``schema/<type>/<field>/fill_rate``: the ratio of items with a value
+      other than None or an empty string, list or dict.
+    - ``schema/<type>/<field>/types``: the value kinds and their counts, as
+      ``kind:count`` pairs separated by commas. For ``[other]``, these are
+      counts of values rather than items.
+    """
+
+    def __init__(self, crawler: Crawler):
+        if not crawler.settings.getbool('SCHEMA_STATS_ENABLED'):
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.max_fields = crawler.settings.getint('SCHEMA_STATS_MAX_FIELDS', 200)
+        # item type -> number of items
+        self.items: dict[str, int] = {}
+        # item type -> field -> counters
+        self.fields: dict[str, dict[str, array]] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> ItemSchemaStats:
+        o = cls(crawler)
+        crawler.signals.connect(o.item_scraped, signals.item_scraped)
+        crawler.signals.connect(o.spider_closed, signals.spider_closed)
+        return o
+
+    def item_scraped(self, item: Any, spider: Spider) -> None:
+        if not ItemAdapter.is_item(item):
+            return
+        adapter = ItemAdapter(item)
+        type_ = adapter.get('_type') or type(item).__name__
+        if not isinstance(type_, str):
+            type_ = str(type_)
+        self.items[type_] = self.items.get(type_, 0) + 1
+        fields = self.fields.setdefault(type_, {})
+        # [other] fields count once per item toward presence and fill rate
+        other_present = other_filled = False
+        for name, value in adapter.items():
+            counters = fields.get(name)
+            if counters is None:
+                if len(fields) >= self.max_fields:
+                    name = OTHER_FIELDS
+                counters = fields.setdefault(name, array('L', [0]) * (_PRESENT + 1))
+            counters[_kind_index(value)] += 1
+            filled = value is not None and bool(value or not hasattr(value, '__len__'))
+            if name == OTHER_FIELDS:
+                other_present = True
+                other_filled = other_filled or filled
+                continue
+            counters[_PRESENT] += 1
+            if filled:
+                counters[_FILLED] += 1
+        if other_present:
+            counters = fields[OTHER_FIELDS]
+            counters[_PRESENT] += 1
+            if other_filled:
+                counters[_FILLED] += 1
+
+    def spider_closed(self, spider: Spider, reason: str) -> None:
+        for type_, count in self.items.items():
+            prefix = 'schema/{}'.format(type_)
+            self.stats.set_value(prefix + '/items', count)
+            for name, counters in self.fields[type_].items():
+                field_prefix = '{}/{}'.format(prefix, name)
+                self.stats.set_value(field_prefix + '/presence', round(counters[_PRESENT] / count, 4))
+                self.stats.set_value(field_prefix + '/fill_rate', round(counters[_FILLED] / count, 4))
+                self.stats.set_value(field_prefix + '/types', ','.join(
+                    '{}:{}'.format(kind, counters[index])
+                    for index, kind in enumerate(VALUE_KINDS) if counters[index]))
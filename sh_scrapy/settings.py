@@ -2,12 +2,17 @@ import os
 import sys
 import logging
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from scrapy.settings import Settings
+from scrapy.utils.conf import init_env
 from scrapy.utils.misc import load_object
 from scrapy.utils.project import get_project_settings
 from scrapy.utils.python import to_unicode
 
+from sh_scrapy.settingscache import get_settings_cache
+from sh_scrapy.startup import phase
+
 
 logger = logging.getLogger(__name__)
 REPLACE_ADDONS_PATHS = {
@@ -35,9 +40,12 @@ SETTINGS_ORDERED_DICTS = [
 ]
 
 try:
-    from scrapy.utils.deprecate import update_classpath
+    from scrapy.utils.deprecate import DEPRECATION_RULES, update_classpath
 except ImportError:
+    DEPRECATION_RULES = []
     update_classpath = lambda x: x
+# Prefixes of the class paths that update_classpath() changes.
+DEPRECATED_PREFIXES = tuple(prefix for prefix, _ in DEPRECATION_RULES)
 
 
 class EntrypointSettings(Settings):
@@ -82,6 +90,24 @@ def _get_component_base(settings, compkey):
     return compkey
 
 
+def get_setting_choice(crawler, name, choices):
+    """Return a setting value among choices, the first one being the default.
+
+    The default is returned, with a warning, for values not in choices, and
+    without a crawler.
+    """
+    default = choices[0]
+    if crawler is None:
+        return default
+    value = crawler.settings.get(name, default)
+    if value not in choices:
+        logger.warning(
+            "Wrong value for %s: should be one of [%s]. Set default '%s' value.",
+            name, ','.join(choices), default)
+        value = default
+    return value
+
+
 def _get_action_on_missing_addons(settings):
     on_missing_addons = settings.get('ON_MISSING_ADDONS', 'warn')
     if on_missing_addons not in ['fail', 'error', 'warn']:
@@ -95,26 +121,24 @@ def _get_action_on_missing_addons(settings):
 def _update_old_classpaths(settings):
     """Update user's project settings with proper class paths.
 
-    Note that the method updates only settings with dicts as values:
-    it's needed for proper dicts merge to avoid duplicates in paths.
-    For all other cases Scrapy will handle it by itself.
+    Note that the method updates only the component dicts of
+    SETTINGS_ORDERED_DICTS: it's needed for proper dicts merge to avoid
+    duplicates in paths. For all other cases Scrapy will handle it by itself.
     """
-    for setting_key in settings.attributes.keys():
-        setting_value = settings[setting_key]
+    if not DEPRECATED_PREFIXES:
+        return
+    for setting_key in SETTINGS_ORDERED_DICTS:
+        components = settings.get(setting_key)
         # A workaround to make it work for:
         # - Scrapy==1.0.5 with dicts as values
         # - Scrapy>=1.1.0 with BaseSettings as values
-        if hasattr(setting_value, 'copy_to_dict'):
-            setting_value = setting_value.copy_to_dict()
-        elif not isinstance(setting_value, dict):
+        if not (hasattr(components, 'copy_to_dict') or isinstance(components, dict)):
             continue
-        for path in setting_value.keys():
-            if not isinstance(path, str):
-                continue
-            updated_path = update_classpath(path)
-            if updated_path != path:
-                order = settings[setting_key].pop(path)
-                settings[setting_key][updated_path] = order
+        deprecated_paths = [path for path in components
+                            if isinstance(path, str) and path.startswith(DEPRECATED_PREFIXES)]
+        for path in deprecated_paths:
+            order = components.pop(path)
+            components[update_classpath(path)] = order
 
 
 def _update_component_order(components, path, order):
@@ -124,16 +148,47 @@ def _update_component_order(components, path, order):
         components[updated_path] = order
 
 
+def _get_addon_path(addon):
+    return REPLACE_ADDONS_PATHS.get(addon['path'], addon['path'])
+
+
+def _import_addon(addon_path):
+    try:
+        load_object(addon_path)
+    except Exception:
+        # e.g. a missing addon, an addon that can only be imported in the
+        # main thread or a concurrent circular import: _load_addons()
+        # imports it again and reports errors
+        pass
+
+
+def _import_addons(addons, threads):
+    """Import addons concurrently, ignoring errors."""
+    paths = list(dict.fromkeys(_get_addon_path(addon) for addon in addons))
+    with ThreadPoolExecutor(max_workers=min(threads, len(paths))) as executor:
+        list(executor.map(_import_addon, paths))
+
+
 def _load_addons(addons, settings, merged_settings, priority=0):
+    """Load addons into settings, return the number of missing ones.
+
+    With ADDONS_IMPORT_THREADS greater than 1, addons are imported with as
+    many threads first. The ones that failed are then imported again in the
+    addons order in the calling thread, and only the errors of that second
+    import are handled, as without threads.
+    """
     on_missing_addons = _get_action_on_missing_addons(merged_settings)
+    threads = merged_settings.getint('ADDONS_IMPORT_THREADS', 0)
+    if threads > 1 and len(addons) > 1:
+        _import_addons(addons, threads)
+    missing = 0
     for addon in addons:
-        addon_path = addon['path']
-        if addon_path in REPLACE_ADDONS_PATHS:
-            addon_path = REPLACE_ADDONS_PATHS[addon_path]
+        addon_path = _get_addon_path(addon)
         try:
             load_object(addon_path)
         except (ImportError, NameError, ValueError) as exc:
             message = "Addon import error {}:\n {}".format(addon_path, exc)
+            missing += 1
             if on_missing_addons == 'warn':
                 logger.warning(message)
                 continue
@@ -146,6 +201,7 @@ def _load_addons(addons, settings, merged_settings, priority=0):
         _update_component_order(components, addon_path, addon['order'])
         merged_settings.set(skey, components)
         merged_settings.setdict(addon['default_settings'], priority)
+    return missing
 
 
 def _merge_with_keeping_order(settings, updates):
@@ -166,31 +222,49 @@ def _populate_settings_base(apisettings, defaults_func, spider=None):
 
     Important note: Scrapy doesn't really copy values on set/setdict methods,
     changing a dict in merged settings means mutating it in original settings.
+
+    When SHUB_SETTINGS_CACHE_DIR is set, the result is cached there for jobs
+    with the same configuration, see sh_scrapy.settingscache.
     """
     assert 'scrapy.conf' not in sys.modules, "Scrapy settings already loaded"
-    settings = get_project_settings().copy()
-    _update_old_classpaths(settings)
-    merged_settings = EntrypointSettings()
-
     enabled_addons = apisettings.setdefault('enabled_addons', [])
     project_settings = apisettings.setdefault('project_settings', {})
     organization_settings = apisettings.setdefault('organization_settings', {})
     spider_settings = apisettings.setdefault('spider_settings', {})
     job_settings = apisettings.setdefault('job_settings', {})
 
+    cache = get_settings_cache()
+    if cache is not None:
+        # as get_project_settings() does, to find the project settings module
+        init_env(os.environ.get('SCRAPY_PROJECT', 'default'))
+        cache_key = cache.get_key(apisettings, defaults_func, spider)
+        settings = cache.load(cache_key)
+        if settings is not None:
+            return settings
+
+    settings = get_project_settings().copy()
+    _update_old_classpaths(settings)
+    merged_settings = EntrypointSettings()
+
     defaults_func(settings)
     merged_settings.setdict(project_settings, priority=10)
     merged_settings.setdict(organization_settings, priority=20)
     if spider:
         merged_settings.setdict(spider_settings, priority=30)
         _maybe_load_autoscraping_project(merged_settings, priority=0)
-        merged_settings.set('JOBDIR', tempfile.mkdtemp(prefix='jobdata-'),
-                            priority=40)
+        jobdir = tempfile.mkdtemp(prefix='jobdata-')
+        merged_settings.set('JOBDIR', jobdir, priority=40)
+    else:
+        jobdir = None
     merged_settings.setdict(job_settings, priority=40)
     # Load addons only after we gather all settings
-    _load_addons(enabled_addons, settings, merged_settings, priority=0)
+    with phase('addons'):
+        missing_addons = _load_addons(enabled_addons, settings, merged_settings, priority=0)
     _merge_with_keeping_order(settings, merged_settings.copy_to_dict())
     _enforce_required_settings(settings)
+    if cache is not None and not missing_addons:
+        # not cached otherwise, for the missing addons to be reported again
+        cache.store(cache_key, settings, jobdir)
     return settings
 
 
@@ -206,6 +280,12 @@ def _load_default_settings(settings):
     extensions = {
         'scrapy.extensions.debug.StackTraceDump': 0,
         'sh_scrapy.extension.HubstorageExtension': 100,
+        'sh_scrapy.extension.ReactorLagMonitor': 0,
+        'sh_scrapy.profiler.SamplingProfiler': 0,
+        'sh_scrapy.timing.ComponentTiming': 0,
+        'sh_scrapy.lineage.RequestLineage': 0,
+        'sh_scrapy.schema.ItemSchemaStats': 0,
+        'sh_scrapy.startup.StartupTrace': 0,
     }
 
     try:
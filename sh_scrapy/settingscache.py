@@ -0,0 +1,153 @@
+"""
+Settings population cache.
+The goal is to skip resolving settings for repeated jobs with the same
+configuration: the settings built by populate_settings() are pickled in the
+SHUB_SETTINGS_CACHE_DIR directory, under a key hashing everything they are
+built from.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from importlib.util import find_spec
+from typing import Any, Callable
+
+from scrapy import __version__ as scrapy_version
+from scrapy.settings import SETTINGS_PRIORITIES, Settings
+
+import sh_scrapy
+from sh_scrapy.entrypoints import installed_distributions
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENVVAR = 'SHUB_SETTINGS_CACHE_DIR'
+# Bump when the content of cache entries or how they are used changes.
+CACHE_VERSION = 1
+# Settings that older Scrapy versions read from SCRAPY_* environment
+# variables, set by the entrypoint to different values for every job.
+PER_JOB_ENV_SETTINGS = ('JOB', 'SPIDER', 'PROJECT_ID')
+# Other environment variables read while populating settings.
+_ENVVARS = ('SCRAPY_PROJECT', 'SHUB_SPIDER_TYPE', 'SHUB_JOB_MEMORY_LIMIT')
+
+
+def _stat(path: str) -> list:
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _project_files(settings_module: str) -> list:
+    """Return the stats of the Python files of the top-level package of the
+    settings module, or of the archive holding it, e.g. a project egg."""
+    spec = find_spec(settings_module.partition('.')[0])
+    if spec is None or spec.origin is None:
+        return []
+    files = []
+    for location in spec.submodule_search_locations or [spec.origin]:
+        while location and not os.path.exists(location):
+            # a path inside an archive
+            location = os.path.dirname(location)
+        if os.path.isfile(location):
+            files.append(_stat(location))
+            continue
+        for dirpath, dirnames, filenames in os.walk(location):
+            dirnames.sort()
+            files.extend(_stat(os.path.join(dirpath, name))
+                         for name in sorted(filenames) if name.endswith('.py'))
+    return files
+
+
+class SettingsCache(object):
+    """Cache of populated settings in a local directory.
+
+    Keys hash the API settings, the spider, the defaults function, the
+    relevant environment variables, the Python, Scrapy and sh_scrapy
+    versions, the size and modification time of the project files and the
+    distributions installed in sys.path.
+
+    The project settings module is not imported on cache hits, so its
+    result must only depend on the above.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_key(self, apisettings: dict, defaults_func: Callable[[Settings], Any],
+                spider: str | None) -> str:
+        settings_module = os.environ.get('SCRAPY_SETTINGS_MODULE')
+        data = {
+            'cache_version': CACHE_VERSION,
+            'python': sys.version,
+            'scrapy': scrapy_version,
+            'sh_scrapy': sh_scrapy.__version__,
+            'distributions': installed_distributions(),
+            'settings_module': settings_module,
+            'project_files': _project_files(settings_module) if settings_module else [],
+            'env': {name: os.environ.get(name) for name in _ENVVARS},
+            'scrapy_env': {
+                name: None if name[7:] in PER_JOB_ENV_SETTINGS else value
+                for name, value in os.environ.items() if name.startswith('SCRAPY_')
+            },
+            'defaults_func': '{}.{}'.format(defaults_func.__module__, defaults_func.__qualname__),
+            'apisettings': apisettings,
+            'spider': spider,
+        }
+        encoded = json.dumps(data, sort_keys=True, default=repr).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.pickle')
+
+    def load(self, key: str) -> Settings | None:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Ignoring invalid settings cache entry %s", path, exc_info=True)
+            return None
+        settings = entry['settings']
+        jobdir = entry['jobdir']
+        if jobdir is not None and settings.get('JOBDIR') == jobdir:
+            settings.set('JOBDIR', tempfile.mkdtemp(prefix='jobdata-'),
+                         priority=settings.getpriority('JOBDIR'))
+        for name in entry['env_settings']:
+            settings.set(name, os.environ['SCRAPY_' + name], priority='project')
+        return settings
+
+    def store(self, key: str, settings: Settings, jobdir: str | None) -> None:
+        """Store settings, with jobdir the JOBDIR created for this job."""
+        env_settings = [
+            name for name in PER_JOB_ENV_SETTINGS
+            if settings.getpriority(name) == SETTINGS_PRIORITIES['project']
+            and settings.get(name) == os.environ.get('SCRAPY_' + name)
+        ]
+        entry = {'settings': settings, 'jobdir': jobdir, 'env_settings': env_settings}
+        try:
+            data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug("Settings can't be cached: %s", e)
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning("Failed to write settings cache entry in %s: %s", self.directory, e)
+
+
+def get_settings_cache() -> SettingsCache | None:
+    directory = os.environ.get(CACHE_DIR_ENVVAR)
+    if not directory:
+        return None
+    return SettingsCache(directory)
@@ -0,0 +1,166 @@
+"""
+Startup tracing extension.
+The goal is to find what slows down the start of short jobs: when the
+SHUB_STARTUP_TRACE environment variable is set, the wall-clock time of the
+start-crawl phases and the import time of every top-level module are
+recorded, then stored in stats and logged when the first request reaches
+the downloader.
+"""
+
+# Only the standard library is imported here: tracing starts when the
+# sh_scrapy package is imported, before Scrapy and its dependencies.
+import builtins
+import logging
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+tracer = None
+
+
+class StartupTracer(object):
+    """Record the duration of startup phases and module import times.
+
+    Import times are the time spent importing each top-level module with
+    import statements, excluding the time spent importing other top-level
+    modules from it. Imports running in several threads at once, e.g. with
+    ADDONS_IMPORT_THREADS, are timed separately, so their total can exceed
+    the wall-clock time.
+    """
+
+    def __init__(self):
+        self.start = self._last = perf_counter()
+        # phase name -> seconds
+        self.phases = {}
+        # top-level module name -> seconds
+        self.imports = {}
+        # per thread, time spent in nested imports of the imports in progress
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._original_import = None
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = name
+        if level:
+            module = (globals or {}).get('__package__') or name
+        elif name in sys.modules and not fromlist:
+            return self._original_import(name, globals, locals, fromlist, level)
+        stack = getattr(self._local, 'nested', None)
+        if stack is None:
+            stack = self._local.nested = []
+        start = perf_counter()
+        stack.append(0.0)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            module = module.partition('.')[0]
+            with self._lock:
+                self.imports[module] = self.imports.get(module, 0.0) + elapsed - nested
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._last = perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + self._last - start
+
+    def mark(self, name):
+        """Record a phase ending now, started at the end of the previous one."""
+        now = perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def report(self, stats, max_imports=20):
+        """Stop tracing imports, store times in stats and log a summary."""
+        self.uninstall()
+        total = perf_counter() - self.start
+        slowest = sorted(self.imports.items(), key=lambda x: x[1], reverse=True)[:max_imports]
+        stats.set_value('startup/total', round(total, 3))
+        stats.set_value('startup/imports', round(sum(self.imports.values()), 3))
+        for name, elapsed in self.phases.items():
+            stats.set_value('startup/phase/{}'.format(name), round(elapsed, 3))
+        for module, elapsed in slowest:
+            stats.set_value('startup/import/{}'.format(module), round(elapsed, 3))
+        logger.info(
+            "Startup took %.3fs. Phases: %s. Slowest imports: %s", total,
+            ', '.join('{} {:.3f}s'.format(*x) for x in self.phases.items()),
+            ', '.join('{} {:.3f}s'.format(*x) for x in slowest))
+
+
+def start():
+    """Start tracing the startup, if it was not started yet."""
+    global tracer
+    if tracer is None:
+        tracer = StartupTracer()
+        tracer.install()
+    return tracer
+
+
+def phase(name):
+    """Context manager recording a startup phase, if tracing was started."""
+    if tracer is None:
+        return nullcontext()
+    return tracer.phase(name)
+
+
+class StartupTrace(object):
+    """Extension that reports startup times when the first request reaches
+    the downloader, or when the spider is closed if none did.
+
+    The ``crawler`` phase ends when the extension is created, and the
+    ``first_request`` phase ends when the first request reaches the
+    downloader. Up to STARTUP_TRACE_MAX_IMPORTS import times are reported.
+    """
+
+    def __init__(self, crawler):
+        from scrapy.exceptions import NotConfigured
+
+        if tracer is None:
+            raise NotConfigured
+        tracer.mark('crawler')
+        self.crawler = crawler
+        self.max_imports = crawler.settings.getint('STARTUP_TRACE_MAX_IMPORTS', 20)
+        self._reported = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy import signals
+
+        o = cls(crawler)
+        crawler.signals.connect(o.request_reached_downloader, signals.request_reached_downloader)
+        crawler.signals.connect(o.spider_closed, signals.spider_closed)
+        return o
+
+    def _report(self):
+        if self._reported:
+            return
+        self._reported = True
+        tracer.report(self.crawler.stats, self.max_imports)
+
+    def request_reached_downloader(self, request, spider):
+        if not self._reported:
+            tracer.mark('first_request')
+            self._report()
+
+    def spider_closed(self, spider, reason):
+        # e.g. without start requests, or when the start failed
+        self._report()
@@ -1,11 +1,37 @@
+import gc
+import os
+import time
+
 from scrapy import Spider
 from scrapy.crawler import Crawler
 from scrapy.statscollectors import StatsCollector
-from twisted.internet import task
 
 from sh_scrapy import hsref, _SCRAPY_NO_SPIDER_ARG
 from sh_scrapy.writer import pipe_writer
 
+try:
+    # stdlib's resource module is only available on unix platforms.
+    import resource
+except ImportError:
+    resource = None
+
+
+def _get_rss():
+    """Return the current resident set size in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _get_open_fds():
+    """Return the number of open file descriptors, or None if unknown."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
 
 class HubStorageStatsCollector(StatsCollector):
 
@@ -15,11 +41,46 @@ class HubStorageStatsCollector(StatsCollector):
         super(HubStorageStatsCollector, self).__init__(crawler)
         self.hsref = hsref.hsref
         self.pipe_writer = pipe_writer
+        self._sample_resources = crawler.settings.getbool('STATS_RESOURCES_ENABLED')
+        self._last_upload = None
 
     def _upload_stats(self) -> None:
+        if self._sample_resources:
+            self._update_resource_stats()
         self.pipe_writer.write_stats(self._stats)
 
+    def _update_resource_stats(self) -> None:
+        now = time.monotonic()
+        # The loop lag is only meaningful between two consecutive periodic
+        # uploads: the first one and the final one on close are not scheduled.
+        samplestask = getattr(self, '_samplestask', None)
+        if self._last_upload is not None and samplestask is not None and samplestask.running:
+            lag = max(now - self._last_upload - self.INTERVAL, 0)
+            self.set_value('resources/loop_lag', round(lag, 3))
+            self.max_value('resources/loop_lag_max', round(lag, 3))
+        self._last_upload = now
+
+        rss = _get_rss()
+        if rss is not None:
+            self.set_value('resources/rss', rss)
+            self.max_value('resources/rss_max', rss)
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            self.set_value('resources/cpu_user', round(usage.ru_utime, 3))
+            self.set_value('resources/cpu_system', round(usage.ru_stime, 3))
+            # ru_maxrss is reported in kilobytes on Linux
+            self.max_value('resources/rss_max', usage.ru_maxrss * 1024)
+        open_fds = _get_open_fds()
+        if open_fds is not None:
+            self.set_value('resources/open_fds', open_fds)
+            self.max_value('resources/open_fds_max', open_fds)
+        for generation, gen_stats in enumerate(gc.get_stats()):
+            self.set_value('resources/gc/gen%d_collections' % generation,
+                           gen_stats['collections'])
+
     def _setup_looping_call(self, _ignored=None, **kwargs) -> None:
+        from twisted.internet import task
+
         self._samplestask = task.LoopingCall(self._upload_stats)
         d = self._samplestask.start(self.INTERVAL, **kwargs)
         d.addErrback(self._setup_looping_call, now=False)
@@ -0,0 +1,201 @@
+"""
+Component timing extension.
+The goal is to find slow downloader middlewares, spider middlewares and item
+pipelines by recording the cumulative time spent in, and the number of calls
+to, each of their ``process_*`` methods into stats.
+"""
+
+from __future__ import annotations
+
+from functools import partial, wraps
+from inspect import isasyncgenfunction, iscoroutinefunction
+from time import perf_counter
+from typing import Any, Callable
+
+from scrapy import Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.python import global_object_name
+
+
+# Methods consuming the output of the previous component: the time spent
+# iterating over that output is not accounted to the wrapped component.
+_UPSTREAM_ARGS = {
+    'process_spider_output': (1, 'result'),
+    'process_spider_output_async': (1, 'result'),
+}
+
+# Methods called before spider_opened, when the extension wraps the others.
+_NOT_TIMED = ('process_start', 'process_start_requests')
+
+
+class _Upstream:
+    """Measure the time spent pulling items from an upstream iterable."""
+
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+
+    def wrap_args(self, args: tuple, kwargs: dict, position: int, name: str) -> tuple[tuple, dict]:
+        if name in kwargs:
+            kwargs = dict(kwargs, **{name: self._wrap(kwargs[name])})
+        elif len(args) > position:
+            args = args[:position] + (self._wrap(args[position]),) + args[position + 1:]
+        return args, kwargs
+
+    def _wrap(self, iterable: Any) -> Any:
+        if hasattr(iterable, '__aiter__'):
+            return self._aiter(iterable)
+        if hasattr(iterable, '__iter__'):
+            return self._iter(iterable)
+        return iterable
+
+    def _iter(self, iterable):
+        it = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                x = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += perf_counter() - start
+            yield x
+
+    async def _aiter(self, iterable):
+        it = iterable.__aiter__()
+        while True:
+            start = perf_counter()
+            try:
+                x = await it.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self.elapsed += perf_counter() - start
+            yield x
+
+
+class ComponentTiming:
+    """Extension that records into stats the cumulative time and number of
+    calls of the ``process_*`` methods of every downloader middleware, spider
+    middleware and item pipeline, except for ``process_start`` and
+    ``process_start_requests``, which run before the spider is opened.
+
+    Stats are stored as ``component_timing/<component>/<method>/time`` (in
+    seconds) and ``component_timing/<component>/<method>/calls``. Time spent
+    in coroutines includes the time they are awaiting, time spent consuming
+    the output of other components is excluded.
+    """
+
+    def __init__(self, crawler: Crawler):
+        if not crawler.settings.getbool('COMPONENT_TIMING_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> ComponentTiming:
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_opened, signals.spider_opened)
+        return o
+
+    def spider_opened(self, spider: Spider) -> None:
+        engine = self.crawler.engine
+        for manager in (engine.downloader.middleware,
+                        engine.scraper.spidermw,
+                        engine.scraper.itemproc):
+            self._instrument(manager)
+
+    def _instrument(self, manager: Any) -> None:
+        requiring_spider = getattr(manager, '_mw_methods_requiring_spider', None)
+        for methodname, methods in manager.methods.items():
+            if not methodname.startswith('process_') or methodname in _NOT_TIMED:
+                continue
+            for index, method in enumerate(methods):
+                if isinstance(method, tuple):
+                    # (sync, async) pairs of process_spider_output in older Scrapy versions
+                    sync, async_ = method
+                    methods[index] = (self._wrap(sync, methodname, requiring_spider),
+                                      self._wrap(async_, methodname + '_async', requiring_spider))
+                else:
+                    methods[index] = self._wrap(method, methodname, requiring_spider)
+
+    def _wrap(self, method: Callable[..., Any] | None, name: str,
+              requiring_spider: set | None) -> Callable[..., Any] | None:
+        if method is None:
+            return None
+        func = method.func if isinstance(method, partial) else method
+        component = global_object_name(type(getattr(func, '__self__', func)))
+        prefix = 'component_timing/{}/{}'.format(component, name)
+        wrapper = self._make_wrapper(method, name, prefix)
+        if requiring_spider is not None and method in requiring_spider:
+            requiring_spider.add(wrapper)
+        return wrapper
+
+    def _record(self, prefix: str, elapsed: float, calls: int = 1) -> None:
+        if calls:
+            self.stats.inc_value(prefix + '/calls', calls)
+        self.stats.inc_value(prefix + '/time', elapsed, start=0.0)
+
+    def _make_wrapper(self, method: Callable[..., Any], name: str, prefix: str) -> Callable[..., Any]:
+        upstream_arg = _UPSTREAM_ARGS.get(name)
+        record = self._record
+
+        if isasyncgenfunction(method):
+
+            @wraps(method)
+            async def wrapper(*args, **kwargs):
+                upstream = _Upstream()
+                if upstream_arg:
+                    args, kwargs = upstream.wrap_args(args, kwargs, *upstream_arg)
+                it = method(*args, **kwargs)
+                calls = 1
+                while True:
+                    start, skipped = perf_counter(), upstream.elapsed
+                    try:
+                        x = await it.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        record(prefix, perf_counter() - start - (upstream.elapsed - skipped), calls)
+                        calls = 0
+                    yield x
+
+        elif iscoroutinefunction(method):
+
+            @wraps(method)
+            async def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    record(prefix, perf_counter() - start)
+
+        else:
+
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                upstream = _Upstream()
+                if upstream_arg:
+                    args, kwargs = upstream.wrap_args(args, kwargs, *upstream_arg)
+                start = perf_counter()
+                try:
+                    result = method(*args, **kwargs)
+                finally:
+                    record(prefix, perf_counter() - start - upstream.elapsed)
+                if upstream_arg and hasattr(result, '__next__'):
+                    return _timed_iter(result, upstream, prefix, record)
+                return result
+
+        return wrapper
+
+
+def _timed_iter(it, upstream, prefix, record):
+    while True:
+        start, skipped = perf_counter(), upstream.elapsed
+        try:
+            x = next(it)
+        except StopIteration:
+            return
+        finally:
+            record(prefix, perf_counter() - start - (upstream.elapsed - skipped), 0)
+        yield x
@@ -0,0 +1,178 @@
+"""
+Pre-forked warm worker for start-crawl.
+The goal is to cut the startup time of short jobs: a server imports Scrapy,
+Twisted, sh_scrapy and the project settings and spiders once, then forks a
+child running start-crawl for every job it receives, sharing the imported
+modules with the server.
+
+Modules are imported with the environment of the server: project settings
+and spiders reading os.environ when imported keep the values of the server,
+not those of the job.
+
+Jobs are submitted on a unix socket, as a JSON line holding the environment
+of the job, e.g. ``{"env": {"SHUB_JOB_DATA": ..., "SHUB_FIFO_PATH": ...}}``.
+The child replies with a ``{"pid": ...}`` line when the job starts and an
+``{"exit_code": ...}`` line when it ends. See submit().
+"""
+
+# Only the standard library is imported here, the rest is imported by
+# _warm_up() so that import errors are reported.
+import atexit
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+
+SOCKET_ENV = 'SHUB_WORKER_SOCKET'
+# seconds children wait for their job request, and the server for new
+# connections between reaping finished children
+REQUEST_TIMEOUT = 10
+ACCEPT_TIMEOUT = 1
+
+
+def _warm_up():
+    """Import the modules used by start-crawl and the project spiders.
+
+    This runs with the environment of the server, see the module docstring.
+    """
+    import scrapy.crawler  # NOQA
+    import sh_scrapy.env  # NOQA
+    import sh_scrapy.extension  # NOQA
+    import sh_scrapy.log  # NOQA
+    import sh_scrapy.middlewares  # NOQA
+    import sh_scrapy.settings  # NOQA
+    import sh_scrapy.stats  # NOQA
+    from scrapy.utils.misc import load_object
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    load_object(settings['SPIDER_LOADER_CLASS']).from_settings(settings.frozencopy())
+
+
+def _reply(conn, message):
+    try:
+        conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    except OSError:
+        # the client is gone, the job goes on
+        pass
+
+
+def _read_request(conn):
+    conn.settimeout(REQUEST_TIMEOUT)
+    with conn.makefile('rb') as f:
+        request = json.loads(f.readline())
+    env = request.get('env') if isinstance(request, dict) else None
+    if not isinstance(env, dict) or not all(
+            isinstance(k, str) and isinstance(v, str) for k, v in env.items()):
+        raise ValueError('job request must be {"env": {<name>: <value>, ...}}')
+    conn.settimeout(None)
+    return env
+
+
+def _reap_children():
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def serve(path):
+    """Accept jobs on the unix socket at path and fork a child for each one.
+
+    In the server, return None when it is stopped with SIGTERM or SIGINT.
+    In children, return the connection to read their job request from, so
+    that a slow client doesn't delay other jobs.
+    """
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(path):
+        os.unlink(path)
+    server.bind(path)
+    server.listen()
+    server.settimeout(ACCEPT_TIMEOUT)
+    stopped = []
+    previous_handler = signal.signal(signal.SIGTERM, lambda *args: stopped.append(True))
+    try:
+        while not stopped:
+            _reap_children()
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            if os.fork() == 0:
+                server.close()
+                signal.signal(signal.SIGTERM, previous_handler)
+                return conn
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    # running jobs are not stopped
+    server.close()
+    os.unlink(path)
+    signal.signal(signal.SIGTERM, previous_handler)
+    return None
+
+
+def _run_job(conn):
+    try:
+        env = _read_request(conn)
+    except (OSError, ValueError) as e:
+        _reply(conn, {'error': str(e)})
+        return 1
+    os.environ.update(env)
+    from sh_scrapy import crawl, hsref, writer
+
+    # Reset the state initialized from the server environment on import.
+    hworker_sentry_dsn = os.environ.pop('HWORKER_SENTRY_DSN', None)
+    crawl._sentry_dsn = os.environ.pop('SENTRY_DSN', hworker_sentry_dsn)
+    hsref.hsref.__init__()
+    writer.pipe_writer._configure(os.environ.get('SHUB_FIFO_PATH', ''), writer._get_spill_file())
+
+    result = {'exit_code': 1}
+    # registered first to run last, once the pipe writer is flushed
+    atexit.register(_reply, conn, result)
+    _reply(conn, {'pid': os.getpid()})
+    code = crawl.main()
+    result['exit_code'] = code if isinstance(code, int) else int(code is not None)
+    return result['exit_code']
+
+
+def submit(path, env, timeout=None):
+    """Run a job in the worker listening at path, return its exit code."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(path)
+        conn.sendall(json.dumps({'env': env}).encode('utf-8') + b'\n')
+        with conn.makefile('rb') as f:
+            for line in f:
+                message = json.loads(line)
+                if 'error' in message:
+                    raise ValueError(message['error'])
+                if 'exit_code' in message:
+                    return message['exit_code']
+    raise RuntimeError('Worker connection closed before the end of the job')
+
+
+def main():
+    """start-crawl-server command, taking the socket path as argument or
+    in the SHUB_WORKER_SOCKET environment variable."""
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get(SOCKET_ENV)
+    if not path:
+        print('usage: start-crawl-server <socket path>', file=sys.stderr)
+        return 2
+    try:
+        _warm_up()
+    except Exception:
+        # jobs import what they need themselves, and report errors
+        traceback.print_exc()
+    conn = serve(path)
+    if conn is None:
+        return 0
+    return _run_job(conn)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,141 @@
 # -*- coding: utf-8 -*-
+import atexit
 import json
+import logging
 import os
+import re
 import threading
+import time
 
-from scrapinghub.hubstorage.serialization import jsondefault
-from scrapinghub.hubstorage.utils import millitime
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('never', 'segment', 'always')
+_SEGMENT_NAME = 'segment-{:06d}.log'
+_SEGMENT_RE = re.compile(r'^segment-(\d+)\.log$')
+
+
+def jsondefault(o):
+    # scrapinghub is only imported for values not serializable to JSON,
+    # it isn't needed otherwise and is slow to import.
+    from scrapinghub.hubstorage.serialization import jsondefault
+    return jsondefault(o)
+
+
+def millitime():
+    return int(time.time() * 1000)
 
 
 def _not_configured(*args, **kwargs):
     raise RuntimeError("Pipe writer is misconfigured, named pipe path is not set")
 
 
+class _SpillFile(object):
+    """Append-only local file split in segments of segment_size bytes.
+
+    Data is flushed on every append and synced to disk according to the
+    fsync policy: never, when a segment is complete, or on every append.
+    Appended data can be read back in order, consumed segments are deleted.
+    Segments left by a previous run in the same directory are kept and
+    never read back.
+
+    The object is not thread safe.
+
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, fsync='never'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Wrong fsync policy {!r}: should be one of [{}]".format(
+                fsync, ','.join(FSYNC_POLICIES)))
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        # number of appended bytes not consumed yet
+        self.pending = 0
+        self._segments = []
+        self._next_segment = None
+        self._write_file = None
+        self._write_size = 0
+        self._read_file = None
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, _SEGMENT_NAME.format(number))
+
+    def _roll(self):
+        if self._next_segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+            numbers = [int(m.group(1)) for m in map(_SEGMENT_RE.match, os.listdir(self.directory)) if m]
+            self._next_segment = max(numbers, default=-1) + 1
+        if self._write_file is not None:
+            self._close_write_file()
+        self._segments.append(self._next_segment)
+        self._write_file = open(self._segment_path(self._next_segment), 'wb')
+        self._write_size = 0
+        self._next_segment += 1
+
+    def _close_write_file(self):
+        self._write_file.flush()
+        if self.fsync != 'never':
+            os.fsync(self._write_file.fileno())
+        self._write_file.close()
+        self._write_file = None
+
+    def append(self, data):
+        if self._write_file is None or self._write_size >= self.segment_size:
+            self._roll()
+        self._write_file.write(data)
+        self._write_file.flush()
+        if self.fsync == 'always':
+            os.fsync(self._write_file.fileno())
+        self._write_size += len(data)
+        self.pending += len(data)
+
+    def peek(self, size):
+        """Return up to size bytes of the oldest data not consumed yet."""
+        if not self.pending:
+            return b''
+        if self._read_file is None:
+            self._read_file = open(self._segment_path(self._segments[0]), 'rb')
+        data = self._read_file.read(size)
+        self._read_file.seek(-len(data), os.SEEK_CUR)
+        if not data and len(self._segments) > 1:
+            # end of a complete segment
+            self._read_file.close()
+            self._read_file = None
+            os.remove(self._segment_path(self._segments.pop(0)))
+            return self.peek(size)
+        return data
+
+    def consume(self, size):
+        """Mark the first size bytes returned by peek() as consumed."""
+        self._read_file.seek(size, os.SEEK_CUR)
+        self.pending -= size
+
+    def close(self):
+        if self._read_file is not None:
+            self._read_file.close()
+            self._read_file = None
+        if self._write_file is not None:
+            self._close_write_file()
+
+
+def _get_spill_file():
+    # Called when this module is imported: invalid settings are reported
+    # without raising, so that the job can still report its failure.
+    directory = os.environ.get('SHUB_SPILL_DIR')
+    if not directory:
+        return None
+    try:
+        return _SpillFile(
+            directory,
+            segment_size=int(os.environ.get('SHUB_SPILL_SEGMENT_SIZE', 64 * 1024 * 1024)),
+            fsync=os.environ.get('SHUB_SPILL_FSYNC', 'never'),
+        )
+    except ValueError as e:
+        logger.warning("Spill file disabled, invalid SHUB_SPILL_* settings: %s", e)
+        return None
+
+
 class _PipeWriter(object):
     """Writer for the Scrapinghub named pipe.
 
@@ -19,24 +144,46 @@ class _PipeWriter(object):
 
     The object is thread safe.
 
+    With a spill file and a named pipe, the pipe is written without blocking
+    and records which don't fit in it are appended to the spill file, then
+    replayed into the pipe on later writes, on flush() and at exit. With a
+    spill file only, records are written to it, e.g. for local runs.
+
     :ivar path: Named pipe path
+    :ivar spill: Optional _SpillFile
 
     """
 
-    def __init__(self, path):
-        self.path = path or ''
+    def __init__(self, path, spill=None):
         self._lock = threading.Lock()
+        self._configure(path, spill)
+
+    def _configure(self, path, spill=None):
+        """Set the named pipe path and spill file of a writer not opened yet."""
+        self.path = path or ''
+        self.spill = spill
         self._pipe = None
-        if not self.path:
+        for name in ('_write', 'open', 'close'):
+            self.__dict__.pop(name, None)
+        if not self.path and spill is None:
             self._write = _not_configured
             self.open = _not_configured
             self.close = _not_configured
 
     def open(self):
         with self._lock:
-            self._pipe = open(self.path, 'wb')
+            if not self.path:
+                return
+            if self.spill is None:
+                self._pipe = open(self.path, 'wb')
+                return
+            self._pipe = open(self.path, 'wb', buffering=0)
+            os.set_blocking(self._pipe.fileno(), False)
+        atexit.register(self.flush)
 
     def _write(self, command, payload):
+        if self.spill is not None:
+            return self._write_line(command, payload)
         # binary command
         command = command.encode('utf-8')
         # binary payload
@@ -53,6 +200,42 @@ class _PipeWriter(object):
             self._pipe.write(b'\n')
             self._pipe.flush()
 
+    def _write_line(self, command, payload):
+        line = b''.join([
+            command.encode('utf-8'),
+            b' ',
+            json.dumps(payload, separators=(',', ':'), default=jsondefault).encode('utf-8'),
+            b'\n',
+        ])
+        with self._lock:
+            if self._pipe is None:
+                self.spill.append(line)
+                return
+            if not self.spill.pending:
+                written = self._pipe.write(line) or 0
+                if written == len(line):
+                    return
+                line = line[written:]
+            self.spill.append(line)
+            self._replay()
+
+    def _replay(self):
+        while self.spill.pending:
+            data = self.spill.peek(64 * 1024)
+            written = self._pipe.write(data) or 0
+            self.spill.consume(written)
+            if written < len(data):
+                break
+
+    def flush(self):
+        """Replay all the spilled records into the named pipe, blocking."""
+        with self._lock:
+            if self._pipe is None or self._pipe.closed:
+                return
+            os.set_blocking(self._pipe.fileno(), True)
+            self._replay()
+            os.set_blocking(self._pipe.fileno(), False)
+
     def write_log(self, level, message):
         log = {
             'time': millitime(),
@@ -84,8 +267,14 @@ class _PipeWriter(object):
         self._write('FIN', {'outcome': outcome})
 
     def close(self):
+        if self.spill is not None:
+            atexit.unregister(self.flush)
+            self.flush()
+            self.spill.close()
+            if self._pipe is None:
+                return
         with self._lock:
             self._pipe.close()
 
 
-pipe_writer = _PipeWriter(os.environ.get('SHUB_FIFO_PATH', ''))
+pipe_writer = _PipeWriter(os.environ.get('SHUB_FIFO_PATH', ''), _get_spill_file())
@@ -1,3 +1,5 @@
+import importlib.metadata
+import importlib.util
 import os
 import sys
 import json
@@ -12,6 +14,7 @@ from sh_scrapy.crawl import _get_apisettings
 from sh_scrapy.crawl import _run
 from sh_scrapy.crawl import _run_scrapy
 from sh_scrapy.crawl import _run_pkgscript
+from sh_scrapy.crawl import _run_script
 from sh_scrapy.crawl import _run_usercode
 from sh_scrapy.crawl import _launch
 from sh_scrapy.crawl import list_spiders
@@ -198,6 +201,70 @@ def test_run_pkgscript_base_usage_python_3_8_plus(entry_points_mock, mocked_run)
     assert sys.argv == ['script.py', 'arg1', 'arg2']
 
 
+@pytest.fixture
+def script_dist(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    metadata = tmp_path / 'project-1.0.dist-info'
+    (metadata / 'scripts').mkdir(parents=True)
+    (metadata / 'scripts' / 'script.py').write_text('result = 1\n')
+    return importlib.metadata.PathDistribution(metadata)
+
+
+def run_script(dist):
+    namespace = {'__name__': '__main__'}
+    with mock.patch('sh_scrapy.crawl.compile', create=True, wraps=compile) as compile_mock:
+        _run_script(dist, 'script.py', namespace)
+    return namespace['result'], compile_mock.called
+
+
+def test_run_script_bytecode_cache(script_dist):
+    assert run_script(script_dist) == (1, True)
+    cache_path = importlib.util.cache_from_source(
+        str(script_dist._path / 'scripts' / 'script.py'))
+    assert os.path.exists(cache_path)
+    assert run_script(script_dist) == (1, False)
+
+
+def test_run_script_bytecode_cache_invalidated(script_dist):
+    run_script(script_dist)
+    (script_dist._path / 'scripts' / 'script.py').write_text('result = 2\n')
+    assert run_script(script_dist) == (2, True)
+    assert run_script(script_dist) == (2, False)
+
+
+def test_run_script_bytecode_cache_invalid_file(script_dist):
+    run_script(script_dist)
+    cache_path = importlib.util.cache_from_source(
+        str(script_dist._path / 'scripts' / 'script.py'))
+    with open(cache_path, 'r+b') as f:
+        f.truncate(20)
+    assert run_script(script_dist) == (1, True)
+    assert run_script(script_dist) == (1, False)
+
+
+def test_run_script_bytecode_cache_read_only(script_dist):
+    # __pycache__ can't be created
+    (script_dist._path / 'scripts' / '__pycache__').write_text('')
+    assert run_script(script_dist) == (1, True)
+    assert run_script(script_dist) == (1, True)
+    assert sorted(os.listdir(str(script_dist._path / 'scripts'))) == ['__pycache__', 'script.py']
+
+
+def test_run_script_bytecode_cache_prefix(script_dist, tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, 'pycache_prefix', str(tmp_path / 'pycache'))
+    assert run_script(script_dist) == (1, True)
+    assert run_script(script_dist) == (1, False)
+    assert (tmp_path / 'pycache').exists()
+    assert not (script_dist._path / 'scripts' / '__pycache__').exists()
+
+
+def test_run_script_dont_write_bytecode(script_dist, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    assert run_script(script_dist) == (1, True)
+    assert run_script(script_dist) == (1, True)
+    assert not (script_dist._path / 'scripts' / '__pycache__').exists()
+
+
 @mock.patch.dict(os.environ, {
     'SHUB_SETTINGS': '{"project_settings": {"SETTING....'})
 @mock.patch('sh_scrapy.crawl._run')
@@ -319,6 +386,22 @@ def test_main(mocked_launch, pipe_writer):
     assert not pipe_writer.close.called
 
 
+@pytest.mark.parametrize('entry_point', ['main', 'list_spiders', 'shub_image_info'])
+def test_entry_point_imports(entry_point):
+    # Scrapy and other dependencies are only imported when the entry point
+    # runs, so that errors raised while importing them are reported.
+    code = (
+        "import sys\n"
+        "before = set(sys.modules)\n"
+        "from sh_scrapy.crawl import {}\n"
+        "print(' '.join(sorted(set(sys.modules) - before)))\n"
+    ).format(entry_point)
+    out, _ = call_command(os.getcwd(), sys.executable, '-c', code)
+    assert set(out.split()) - set(sys.stdlib_module_names) == {
+        'sh_scrapy', 'sh_scrapy.crawl', 'sh_scrapy.exceptions', 'sh_scrapy.startup',
+    }
+
+
 def test_image_info(tmp_path):
     project_dir = create_project(tmp_path)
     out, err = call_command(project_dir, "shub-image-info")
@@ -0,0 +1,105 @@
+import os
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.dedup import DEDUP_STATE_FILENAME, BloomFilter, ItemDeduplicator
+
+
+def get_deduplicator(**settings):
+    crawler = get_crawler(Spider, dict({'ITEM_DEDUP_FIELDS': ['id']}, **settings))
+    return ItemDeduplicator(crawler), crawler.stats
+
+
+def is_duplicate(dedup, item):
+    """Check an item, and add it if it is written."""
+    key = dedup.get_key(item)
+    if dedup.is_duplicate(key):
+        return True
+    dedup.add(key)
+    return False
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    assert bloom.num_bits == 9585
+    assert bloom.num_hashes == 7
+    assert not bloom.add(b'a')
+    assert bloom.add(b'a')
+    assert not bloom.add(b'b')
+    assert bloom.count == 2
+
+
+def test_bloom_filter_error_rate():
+    bloom = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        bloom.add(str(i).encode())
+    assert all(str(i).encode() in bloom for i in range(10000))
+    false_positives = sum(str(-i).encode() in bloom for i in range(1, 10001))
+    assert false_positives < 150
+
+
+def test_dedup_fields():
+    dedup, stats = get_deduplicator(ITEM_DEDUP_FIELDS=['id', 'site'])
+    assert not is_duplicate(dedup, {'id': 1, 'site': 'a', 'name': 'x'})
+    assert is_duplicate(dedup, {'id': 1, 'site': 'a', 'name': 'y'})
+    assert not is_duplicate(dedup, {'id': 1, 'site': 'b'})
+    assert not is_duplicate(dedup, {'id': 1})
+    assert is_duplicate(dedup, {'id': 1, 'site': None})
+    assert stats.get_value('item_dedup/dropped') == 2
+
+
+def test_dedup_missing_fields():
+    dedup, stats = get_deduplicator(ITEM_DEDUP_FIELDS=['url'])
+    assert dedup.get_key({'name': 'a'}) is None
+    assert not is_duplicate(dedup, {'name': 'a'})
+    assert not is_duplicate(dedup, {'name': 'b'})
+    assert not is_duplicate(dedup, {'name': 'c'})
+    assert stats.get_value('item_dedup/dropped') is None
+    assert dedup.filter.count == 0
+
+
+def test_dedup_type():
+    dedup, _ = get_deduplicator(ITEM_DEDUP_FIELDS=['url'])
+    assert not is_duplicate(dedup, {'_type': 'Product', 'url': 'a'})
+    assert not is_duplicate(dedup, {'_type': 'Other', 'url': 'a'})
+    assert is_duplicate(dedup, {'_type': 'Product', 'url': 'a'})
+
+
+def test_dedup_added_when_written():
+    dedup, _ = get_deduplicator()
+    key = dedup.get_key({'id': 1})
+    assert not dedup.is_duplicate(key)
+    assert not dedup.is_duplicate(key)
+    dedup.add(key)
+    assert dedup.is_duplicate(key)
+
+
+def test_dedup_over_capacity(caplog):
+    dedup, _ = get_deduplicator(ITEM_DEDUP_CAPACITY=2)
+    for i in range(3):
+        is_duplicate(dedup, {'id': i})
+    assert "over its capacity of 2 keys" in caplog.text
+
+
+def test_dedup_jobdir(tmpdir):
+    dedup, stats = get_deduplicator(JOBDIR=str(tmpdir))
+    assert not is_duplicate(dedup, {'id': 1})
+    dedup.close()
+    assert stats.get_value('item_dedup/keys') == 1
+    assert os.path.exists(os.path.join(str(tmpdir), DEDUP_STATE_FILENAME))
+
+    dedup, _ = get_deduplicator(JOBDIR=str(tmpdir))
+    assert dedup.filter.count == 1
+    assert is_duplicate(dedup, {'id': 1})
+    assert not is_duplicate(dedup, {'id': 2})
+
+
+def test_dedup_jobdir_size_changed(tmpdir, caplog):
+    dedup, _ = get_deduplicator(JOBDIR=str(tmpdir))
+    is_duplicate(dedup, {'id': 1})
+    dedup.close()
+    dedup, _ = get_deduplicator(JOBDIR=str(tmpdir), ITEM_DEDUP_CAPACITY=10)
+    assert not is_duplicate(dedup, {'id': 1})
+    assert "Ignoring item dedup filter" in caplog.text
+
@@ -0,0 +1,99 @@
+import importlib.metadata
+import os
+
+import mock
+import pytest
+
+from sh_scrapy.entrypoints import find_distribution
+
+
+def create_distribution(site_packages, name='project', version='1.0',
+                        entry_points='[scrapy]\nsettings = project.settings\n'):
+    metadata = site_packages / '{}-{}.dist-info'.format(name, version)
+    metadata.mkdir()
+    (metadata / 'METADATA').write_text('Name: {}\nVersion: {}\n'.format(name, version))
+    (metadata / 'entry_points.txt').write_text(entry_points)
+    return metadata
+
+
+@pytest.fixture
+def site_packages(tmp_path, monkeypatch):
+    site_packages = tmp_path / 'site-packages'
+    site_packages.mkdir()
+    monkeypatch.syspath_prepend(str(site_packages))
+    monkeypatch.setenv('SHUB_ENTRY_POINTS_CACHE_DIR', str(tmp_path / 'cache'))
+    return site_packages
+
+
+def find():
+    with mock.patch('importlib.metadata.entry_points',
+                    wraps=importlib.metadata.entry_points) as entry_points:
+        dist = find_distribution('scrapy', 'settings')
+    return dist, entry_points.called
+
+
+def test_cache_disabled(site_packages, monkeypatch, tmp_path):
+    monkeypatch.delenv('SHUB_ENTRY_POINTS_CACHE_DIR')
+    metadata = create_distribution(site_packages)
+    assert find()[1]
+    dist, scanned = find()
+    assert scanned
+    assert dist._path == metadata
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_cache_hit(site_packages):
+    metadata = create_distribution(site_packages)
+    dist, scanned = find()
+    assert scanned
+    assert dist._path == metadata
+    dist, scanned = find()
+    assert not scanned
+    assert isinstance(dist, importlib.metadata.PathDistribution)
+    assert dist._path == metadata
+    assert dist.read_text('entry_points.txt') == '[scrapy]\nsettings = project.settings\n'
+
+
+def test_cache_invalidated_by_installed_distributions(site_packages):
+    create_distribution(site_packages)
+    find()
+    create_distribution(site_packages, name='other')
+    assert find()[1]
+    assert not find()[1]
+
+
+def test_cache_invalidated_by_entry_points(site_packages):
+    metadata = create_distribution(site_packages)
+    find()
+    (metadata / 'entry_points.txt').write_text('[scrapy]\nsettings = other.settings\n')
+    os.utime(str(metadata / 'entry_points.txt'), ns=(0, 0))
+    dist, scanned = find()
+    assert scanned
+    assert dist._path == metadata
+
+
+def test_not_found_not_cached(site_packages, tmp_path):
+    create_distribution(site_packages, entry_points='[console_scripts]\nproject = project:main\n')
+    assert find() == (None, True)
+    assert find() == (None, True)
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_invalid_entry(site_packages, tmp_path, caplog):
+    metadata = create_distribution(site_packages)
+    find()
+    for path in (tmp_path / 'cache').iterdir():
+        path.write_text('{')
+    dist, scanned = find()
+    assert scanned
+    assert dist._path == metadata
+    assert "Ignoring invalid entry point cache entry" in caplog.text
+    assert not find()[1]
+
+
+def test_read_only_directory(site_packages, tmp_path, caplog):
+    create_distribution(site_packages)
+    (tmp_path / 'cache').write_text('')
+    assert find()[1]
+    assert find()[1]
+    assert "Failed to write entry point cache entry" in caplog.text
@@ -2,11 +2,15 @@ import os
 import sys
 import mock
 import codecs
+import gzip
+import json
 import pytest
 import tempfile
+from base64 import b64decode, b64encode
 
 from scrapy.utils.python import to_bytes, to_unicode
 
+import sh_scrapy.env
 from sh_scrapy.env import _jobauth
 from sh_scrapy.env import _jobname
 from sh_scrapy.env import decode_uri
@@ -148,6 +152,98 @@ def test_decode_uri_from_file():
         assert decode_uri('file://' + temp.name) == {'hello': 'world'}
 
 
+def test_decode_uri_from_empty_file():
+    with tempfile.NamedTemporaryFile() as temp:
+        with pytest.raises(ValueError):
+            decode_uri(temp.name)
+
+
+@mock.patch.dict('sh_scrapy.env._data_uris', clear=True)
+def test_decode_uri_memoized():
+    uri = 'data:application/json;base64,eyJoZWxsbyI6IFsid29ybGQiXX0='
+    with mock.patch('sh_scrapy.env.b64decode', wraps=b64decode) as b64decode_mock:
+        result1 = decode_uri(uri)
+        result2 = decode_uri(uri)
+    assert b64decode_mock.call_count == 1
+    assert result1 == result2 == {'hello': ['world']}
+    result1['hello'].append('changed')
+    assert result2 == {'hello': ['world']}
+    assert decode_uri(uri) == {'hello': ['world']}
+
+
+@mock.patch.dict('sh_scrapy.env._data_uris', clear=True)
+@mock.patch('sh_scrapy.env._DATA_URIS_MAX', 2)
+def test_decode_uri_memoized_max():
+    for value in range(5):
+        decode_uri('data:;base64,' + b64encode(str(value).encode()).decode())
+    assert 0 < len(sh_scrapy.env._data_uris) <= 2
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_decode_uri_json_parser(use_orjson, tmp_path):
+    orjson = sh_scrapy.env.orjson if use_orjson else None
+    if use_orjson and orjson is None:
+        pytest.skip('orjson is not installed')
+    data = '{"a": "\u00e9", "b": [1, 2.5, null, true], "big": 123456789012345678901234567890, "nan": NaN}'
+    path = tmp_path / 'data.json'
+    path.write_text(data)
+    with mock.patch('sh_scrapy.env.orjson', orjson):
+        for uri in (data, str(path), 'data:;base64,' + b64encode(data.encode()).decode()):
+            result = decode_uri(uri)
+            assert result['a'] == '\u00e9'
+            assert result['b'] == [1, 2.5, None, True]
+            assert result['big'] == 123456789012345678901234567890
+            assert result['nan'] != result['nan']
+
+
+def _get_zstd_compress():
+    try:
+        from compression import zstd
+        return zstd.compress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard.ZstdCompressor().compress
+    except ImportError:
+        return None
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'zstd'])
+@mock.patch.dict('sh_scrapy.env._data_uris', clear=True)
+def test_decode_uri_compressed(encoding):
+    compress = gzip.compress if encoding == 'gzip' else _get_zstd_compress()
+    if compress is None:
+        pytest.skip('zstd is not available')
+    value = {'project_settings': {'SETTING_{}'.format(i): '\u00e9' * i for i in range(100)}}
+    payload = b64encode(compress(json.dumps(value).encode('utf-8'))).decode()
+    for prefix in ('data:application/json;encoding={};base64,',
+                   'data:;charset=utf-8;encoding={};base64,'):
+        assert decode_uri(prefix.format(encoding) + payload) == value
+    payload = b64encode(compress(b'binary')).decode()
+    assert decode_uri('data:custom-mime;encoding={};base64,'.format(encoding) + payload) == b'binary'
+
+
+@mock.patch.dict('sys.modules', {'compression': None, 'zstandard': None})
+def test_decode_uri_zstd_not_available():
+    with pytest.raises(ValueError, match='zstd'):
+        decode_uri('data:;encoding=zstd;base64,KLUv/SAEIQAAdGVzdA==')
+
+
+@pytest.mark.parametrize('uri', [
+    'data:;encoding=br;base64,ImhlbGxvIHdvcmxkIg==',
+    'data:;encoding=gzip,"hello world"',
+])
+def test_decode_uri_compressed_invalid(uri):
+    with pytest.raises(ValueError):
+        decode_uri(uri)
+
+
+def test_decode_uri_charset():
+    uri = 'data:application/json;charset=latin-1;base64,' + b64encode('"\u00e9"'.encode('latin-1')).decode()
+    assert decode_uri(uri) == '\u00e9'
+
+
 def test_setup_environment():
     builtin_mod = '__builtin__' if sys.version_info < (3,) else 'builtins'
     with mock.patch(builtin_mod + '.open') as mock_open:
@@ -1,4 +1,5 @@
 import sys
+import threading
 from weakref import WeakKeyDictionary
 
 import mock
@@ -12,15 +13,23 @@ from scrapy.http import Request, Response
 from scrapy.item import Item
 from scrapy.utils.test import get_crawler
 
-from sh_scrapy.extension import HubstorageExtension, HubstorageMiddleware
+from scrapy.exceptions import NotConfigured
+
+from sh_scrapy.extension import HubstorageExtension, HubstorageMiddleware, ReactorLagMonitor
 from sh_scrapy.middlewares import HS_PARENT_ID_KEY
 
 
 @pytest.fixture
-def hs_ext(monkeypatch):
+def hs_ext_settings():
+    """Crawler settings of hs_ext, to override with parametrize."""
+    return {}
+
+
+@pytest.fixture
+def hs_ext(monkeypatch, hs_ext_settings):
     monkeypatch.setattr('sh_scrapy.extension.pipe_writer', mock.Mock())
     monkeypatch.setattr('sh_scrapy.extension.hsref', mock.Mock())
-    crawler = get_crawler(Spider)
+    crawler = get_crawler(Spider, hs_ext_settings)
     return HubstorageExtension.from_crawler(crawler)
 
 
@@ -92,6 +101,104 @@ def test_hs_ext_spider_closed(hs_ext):
     assert hs_ext.pipe_writer.set_outcome.call_args == mock.call('killed')
 
 
+def test_hs_ext_size_guard_disabled_by_default(hs_ext):
+    assert hs_ext.size_guard is None
+
+
+@pytest.mark.parametrize('hs_ext_settings', [{'ITEM_SIZE_LIMIT': 100}])
+def test_hs_ext_item_size_guard(hs_ext):
+    hs_ext._write_item = mock.Mock()
+    spider = Spider('test')
+    hs_ext.item_scraped({'a': 'x' * 200}, spider)
+    assert hs_ext._write_item.call_count == 0
+    hs_ext.item_scraped({'a': 'x'}, spider)
+    assert hs_ext._write_item.call_args[0] == ({'a': 'x', '_type': 'dict'},)
+
+
+def test_hs_ext_dedup_disabled_by_default(hs_ext):
+    assert hs_ext.deduplicator is None
+
+
+@pytest.mark.parametrize('hs_ext_settings', [{'ITEM_DEDUP_FIELDS': ['id']}])
+def test_hs_ext_dedup(hs_ext):
+    hs_ext._write_item = mock.Mock()
+    spider = Spider('test')
+    hs_ext.item_scraped({'id': 1}, spider)
+    hs_ext.item_scraped({'id': 1}, spider)
+    hs_ext.item_scraped({'name': 'a'}, spider)
+    hs_ext.item_scraped({'name': 'b'}, spider)
+    assert hs_ext._write_item.call_count == 3
+    hs_ext.spider_closed(spider, 'finished')
+    assert hs_ext.crawler.stats.get_value('item_dedup/dropped') == 1
+    assert hs_ext.crawler.stats.get_value('item_dedup/keys') == 1
+
+
+@pytest.mark.parametrize('hs_ext_settings', [{
+    'ITEM_DEDUP_FIELDS': ['id'], 'ITEM_SIZE_LIMIT': 100}])
+def test_hs_ext_dedup_item_size_dropped(hs_ext):
+    hs_ext._write_item = mock.Mock()
+    spider = Spider('test')
+    # dropped by the size guard, so not a duplicate of the next item
+    hs_ext.item_scraped({'id': 1, 'body': 'x' * 1000}, spider)
+    hs_ext.item_scraped({'id': 1, 'body': 'x'}, spider)
+    hs_ext.item_scraped({'id': 1, 'body': 'y'}, spider)
+    assert hs_ext._write_item.call_count == 1
+    assert hs_ext._write_item.call_args[0][0]['body'] == 'x'
+    assert hs_ext.crawler.stats.get_value('item_dedup/dropped') == 1
+
+
+def test_reactor_lag_monitor_disabled_by_default():
+    crawler = get_crawler(Spider)
+    with pytest.raises(NotConfigured):
+        ReactorLagMonitor.from_crawler(crawler)
+
+
+@pytest.fixture
+def lag_monitor():
+    crawler = get_crawler(Spider, {'REACTOR_LAG_ENABLED': True})
+    crawler.stats = mock.Mock()
+    monitor = ReactorLagMonitor.from_crawler(crawler)
+    monitor._schedule = mock.Mock()
+    return monitor
+
+
+@mock.patch('sh_scrapy.extension.time.monotonic')
+def test_reactor_lag_monitor_percentiles(monotonic, lag_monitor):
+    for lag in [0.001] * 90 + [0.2] * 9 + [3.0]:
+        lag_monitor._expected = 10.0
+        monotonic.return_value = 10.0 + lag
+        lag_monitor._tick()
+    assert lag_monitor._schedule.call_count == 100
+    lag_monitor.stats.max_value.assert_called_with('reactor_lag/max', 3.0)
+    lag_monitor.spider_closed(Spider('test'), 'finished')
+    lag_monitor.stats.set_value.assert_has_calls([
+        mock.call('reactor_lag/samples', 100),
+        mock.call('reactor_lag/p50', 0.001),
+        mock.call('reactor_lag/p90', 0.001),
+        mock.call('reactor_lag/p99', 0.2),
+    ])
+
+
+@mock.patch('sh_scrapy.extension.time.monotonic')
+def test_reactor_lag_monitor_stall(monotonic, lag_monitor):
+    lag_monitor._heartbeat = 100.0
+    lag_monitor._reactor_thread_id = threading.get_ident()
+    monotonic.return_value = 100.0 + lag_monitor.interval + 1
+    lag_monitor._check_stall()
+    assert lag_monitor._stalls == 0
+    monotonic.return_value = 100.0 + lag_monitor.interval + 10
+    with mock.patch.object(lag_monitor, 'logger') as logger:
+        lag_monitor._check_stall()
+        # the same stall is only reported once
+        lag_monitor._check_stall()
+    assert logger.warning.call_count == 1
+    assert 'test_reactor_lag_monitor_stall' in logger.warning.call_args[0][2]
+    # stats are only updated from the reactor thread
+    assert not lag_monitor.stats.method_calls
+    lag_monitor.spider_closed(Spider('test'), 'finished')
+    lag_monitor.stats.set_value.assert_called_once_with('reactor_lag/stalls', 1)
+
+
 @pytest.fixture
 def hs_mware(monkeypatch):
     monkeypatch.setattr('sh_scrapy.extension.pipe_writer', mock.Mock())
@@ -0,0 +1,92 @@
+import json
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.itemsize import OFFLOADED_KEY, ItemSizeGuard, estimate_size
+
+
+def get_guard(**settings):
+    crawler = get_crawler(Spider, dict({'ITEM_SIZE_LIMIT': 100}, **settings))
+    return ItemSizeGuard(crawler), crawler.stats
+
+
+def test_estimate_size():
+    item = {'a': 'x' * 10, 'b': [1, None, b'yy'], 'c': {'d': 1.5}}
+    encoded = json.dumps({'a': 'x' * 10, 'b': [1, None, 'yy'], 'c': {'d': 1.5}}, separators=(',', ':'))
+    # strings are exact, other scalars are rounded up
+    assert len(encoded) <= estimate_size(item) <= len(encoded) + 20
+    assert estimate_size('x' * 1000, limit=10) == 1002
+    # estimation stops early on big containers
+    assert estimate_size(['x' * 100] * 1000, limit=10) < 2000
+
+
+def test_size_guard_small_item():
+    guard, stats = get_guard()
+    item = {'a': 'b'}
+    assert guard.process(item) is item
+    assert stats.get_value('item_size/oversized') is None
+
+
+def test_size_guard_drop():
+    guard, stats = get_guard()
+    assert guard.process({'a': 'x' * 200}) is None
+    assert stats.get_value('item_size/oversized') == 1
+    assert stats.get_value('item_size/dropped') == 1
+    assert stats.get_value('item_size/dropped_bytes') == 208
+
+
+def test_size_guard_wrong_policy(caplog):
+    guard, _ = get_guard(ITEM_SIZE_POLICY='wrong')
+    assert guard.policy == 'drop'
+    assert "Wrong value for ITEM_SIZE_POLICY" in caplog.text
+
+
+def test_size_guard_truncate():
+    guard, stats = get_guard(ITEM_SIZE_POLICY='truncate', ITEM_SIZE_FIELD_LIMIT=50)
+    item = guard.process({'a': 'x' * 200, 'b': 'y' * 20})
+    assert item == {'a': 'x' * 50, 'b': 'y' * 20}
+    assert stats.get_value('item_size/truncated') == 1
+    assert stats.get_value('item_size/truncated_bytes') == 150
+    assert stats.get_value('item_size/dropped') is None
+
+
+def test_size_guard_truncate_utf8():
+    guard, stats = get_guard(ITEM_SIZE_POLICY='truncate', ITEM_SIZE_FIELD_LIMIT=50)
+    # 2 bytes characters, the limit falls in the middle of the 26th one
+    item = guard.process({'a': 'é' * 30 + 'x' * 100})
+    assert item == {'a': 'é' * 25}
+    assert stats.get_value('item_size/truncated') == 1
+    assert stats.get_value('item_size/truncated_bytes') == 110
+    item = guard.process({'a': 'x' + 'é' * 100})
+    assert item == {'a': 'x' + 'é' * 24}
+    assert stats.get_value('item_size/truncated_bytes') == 110 + 152
+
+
+def test_size_guard_truncate_bytes():
+    guard, stats = get_guard(ITEM_SIZE_POLICY='truncate', ITEM_SIZE_FIELD_LIMIT=50)
+    assert guard.process({'a': b'x' * 200}) == {'a': b'x' * 50}
+    assert stats.get_value('item_size/truncated_bytes') == 150
+
+
+def test_size_guard_truncate_fields():
+    guard, stats = get_guard(ITEM_SIZE_POLICY='truncate', ITEM_SIZE_FIELDS=['b'],
+                             ITEM_SIZE_FIELD_LIMIT=50)
+    # truncating the configured fields is not enough
+    assert guard.process({'a': 'x' * 200, 'b': 'y' * 200}) is None
+    assert stats.get_value('item_size/truncated') == 1
+    assert stats.get_value('item_size/dropped') == 1
+
+
+def test_size_guard_offload(tmpdir):
+    guard, stats = get_guard(ITEM_SIZE_LIMIT=500, ITEM_SIZE_POLICY='offload',
+                             ITEM_SIZE_FIELD_LIMIT=50, ITEM_SIZE_OFFLOAD_DIR=str(tmpdir))
+    value = ['x' * 300, {'y': 'z' * 300}]
+    item = guard.process({'a': value, 'b': 'small'})
+    assert item['b'] == 'small'
+    path = item['a'][OFFLOADED_KEY]
+    with open(path) as f:
+        assert json.load(f) == value
+    assert item['a']['size'] == len(json.dumps(value))
+    assert stats.get_value('item_size/offloaded') == 1
+    assert stats.get_value('item_size/offloaded_bytes') == item['a']['size']
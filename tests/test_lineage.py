@@ -0,0 +1,77 @@
+import gzip
+
+import mock
+import pytest
+from scrapy import Spider, Request
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.lineage import RequestLineage, get_lineage
+from sh_scrapy.middlewares import HubstorageDownloaderMiddleware, HS_PARENT_ID_KEY
+
+
+@pytest.fixture
+def lineage():
+    crawler = get_crawler(Spider, {'LINEAGE_ENABLED': True})
+    return RequestLineage.from_crawler(crawler)
+
+
+def test_lineage_disabled_by_default():
+    crawler = get_crawler(Spider)
+    with pytest.raises(NotConfigured):
+        RequestLineage.from_crawler(crawler)
+    assert get_lineage(crawler) is None
+
+
+def test_lineage_add(lineage):
+    lineage.add(0, None)
+    lineage.add(1, 0)
+    lineage.add(2, 1)
+    lineage.add(3, 0)
+    assert list(lineage.parents) == [-1, 0, 1, 0]
+    assert list(lineage.depths) == [0, 1, 2, 1]
+    assert lineage.depth_distribution() == {0: 1, 1: 2, 2: 1}
+
+
+def test_lineage_add_resumed(lineage):
+    # ids and parents from a previous process
+    lineage.add(10, 4)
+    lineage.add(12, 10)
+    assert list(lineage.parents) == [4, -1, 10]
+    assert list(lineage.depths) == [0, 0, 1]
+
+
+def test_lineage_spider_closed(lineage, tmp_path):
+    output = tmp_path / 'lineage.csv.gz'
+    lineage.output_file = str(output)
+    lineage.add(0, None)
+    lineage.add(1, 0)
+    lineage.add(2, 0)
+    lineage.spider_closed(Spider('test'), 'finished')
+    stats = lineage.crawler.stats
+    assert stats.get_value('lineage/requests') == 3
+    assert stats.get_value('lineage/max_depth') == 1
+    assert stats.get_value('lineage/depth/0') == 1
+    assert stats.get_value('lineage/depth/1') == 2
+    with gzip.open(str(output), 'rt') as f:
+        assert f.read() == 'id,parent,depth\n0,,0\n1,0,1\n2,0,1\n'
+
+
+def test_lineage_fed_by_downloader_middleware(monkeypatch):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    monkeypatch.setattr('sh_scrapy.middlewares.request_id_sequence', iter([7, 8]))
+    crawler = get_crawler(Spider, {
+        'LINEAGE_ENABLED': True,
+        'EXTENSIONS': {'sh_scrapy.lineage.RequestLineage': 0},
+    })
+    lineage = get_lineage(crawler)
+    assert isinstance(lineage, RequestLineage)
+    mw = HubstorageDownloaderMiddleware.from_crawler(crawler)
+    request = Request('http://example.com')
+    mw._process_response(request, Response(request.url))
+    child = Request('http://example.com/child', meta={HS_PARENT_ID_KEY: 7})
+    mw._process_response(child, Response(child.url))
+    assert lineage.first_id == 7
+    assert list(lineage.parents) == [-1, 7]
+    assert list(lineage.depths) == [0, 1]
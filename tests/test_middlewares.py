@@ -1,17 +1,19 @@
 # -*- coding: utf-8 -*-
 from weakref import WeakKeyDictionary
 import itertools
+import mock
 import pytest
 import sys
 from scrapy import Spider, Request, Item
 from scrapy.http import Response
+from scrapy.utils.defer import deferred_f_from_coro_f
 from scrapy.utils.test import get_crawler
 from typing import Optional
 
 from sh_scrapy import _SCRAPY_NO_SPIDER_ARG
 from sh_scrapy.middlewares import (
     HubstorageSpiderMiddleware, HubstorageDownloaderMiddleware,
-    HS_REQUEST_ID_KEY, HS_PARENT_ID_KEY
+    HS_REQUEST_ID_KEY, HS_PARENT_ID_KEY, HS_RESPONSE_SIZE_KEY
 )
 
 
@@ -217,3 +219,202 @@ def test_hs_middlewares_retry(hs_downloader_middleware, hs_spider_middleware):
 
     assert request_2.meta[HS_REQUEST_ID_KEY] == 2
     assert request_2.meta[HS_PARENT_ID_KEY] == 0
+
+
+def test_hs_middlewares_meta_tracking(monkeypatch_globals):
+    crawler = get_crawler(settings_dict={'HUBSTORAGE_REQUEST_TRACKING': 'meta'})
+    hs_downloader_middleware = HubstorageDownloaderMiddleware.from_crawler(crawler)
+    hs_spider_middleware = HubstorageSpiderMiddleware.from_crawler(crawler)
+
+    spider = Spider('test')
+    url = 'http://resp-url'
+    request_0 = Request(url)
+    response_0 = Response(url, request=request_0)
+    if _SCRAPY_NO_SPIDER_ARG:
+        hs_downloader_middleware.process_request(request_0)
+        hs_downloader_middleware.process_response(request_0, response_0)
+    else:
+        hs_downloader_middleware.process_request(request_0, spider)
+        hs_downloader_middleware.process_response(request_0, response_0, spider)
+
+    assert request_0.meta[HS_REQUEST_ID_KEY] == 0
+    assert len(hs_downloader_middleware._seen_requests) == 0
+
+    request_1 = Request(url)
+    if _SCRAPY_NO_SPIDER_ARG:
+        processed_output = list(hs_spider_middleware.process_spider_output(response_0, [request_1]))
+    else:
+        processed_output = list(hs_spider_middleware.process_spider_output(response_0, [request_1], spider))
+    assert processed_output == [request_1]
+    assert request_1.meta[HS_PARENT_ID_KEY] == 0
+
+    response_1 = Response(url, request=request_1)
+    if _SCRAPY_NO_SPIDER_ARG:
+        hs_downloader_middleware.process_request(request_1)
+        hs_downloader_middleware.process_response(request_1, response_1)
+    else:
+        hs_downloader_middleware.process_request(request_1, spider)
+        hs_downloader_middleware.process_response(request_1, response_1, spider)
+    assert request_1.meta[HS_REQUEST_ID_KEY] == 1
+    assert request_1.meta[HS_PARENT_ID_KEY] == 0
+
+    # ids copied with the meta of a downloaded request are ignored
+    request_2 = request_1.replace(url=url + '/copy')
+    response_2 = Response(request_2.url, request=request_2)
+    request_3 = Request(url)
+    if _SCRAPY_NO_SPIDER_ARG:
+        list(hs_spider_middleware.process_spider_output(response_2, [request_3]))
+    else:
+        list(hs_spider_middleware.process_spider_output(response_2, [request_3], spider))
+    assert request_3.meta[HS_PARENT_ID_KEY] is None
+
+
+def test_hs_middlewares_wrong_tracking(monkeypatch_globals, caplog):
+    crawler = get_crawler(settings_dict={'HUBSTORAGE_REQUEST_TRACKING': 'wrong'})
+    hs_spider_middleware = HubstorageSpiderMiddleware.from_crawler(crawler)
+    assert hs_spider_middleware._track_in_meta is False
+    assert 'Wrong value for HUBSTORAGE_REQUEST_TRACKING' in caplog.text
+
+
+def test_hs_downloader_middleware_fingerprint_disabled(monkeypatch_globals, monkeypatch):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    crawler = get_crawler(settings_dict={"HUBSTORAGE_REQUEST_FINGERPRINT": False})
+    mw = HubstorageDownloaderMiddleware.from_crawler(crawler)
+    request = Request('http://req-url')
+    mw._process_response(request, Response('http://req-url'))
+    assert mw.pipe_writer.write_request.call_args[1]["fp"] is None
+
+
+def test_hs_downloader_middleware_custom_fingerprinter(monkeypatch_globals, monkeypatch):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+
+    class CustomFingerprinter:
+        def fingerprint(self, request):
+            return b"foo"
+
+    crawler = get_crawler(settings_dict={"REQUEST_FINGERPRINTER_CLASS": CustomFingerprinter})
+    mw = HubstorageDownloaderMiddleware.from_crawler(crawler)
+    request = Request('http://req-url')
+    mw._process_response(request, Response('http://req-url'))
+    assert mw.pipe_writer.write_request.call_args[1]["fp"] == b"foo".hex()
+
+
+class UnreadableBodyResponse(Response):
+    @property
+    def body(self):
+        raise AssertionError("the body must not be accessed")
+
+
+@pytest.mark.parametrize('mode,response,expected', [
+    ('body', Response('http://req-url', body=b'abc'), 3),
+    ('headers', Response('http://req-url', body=b'abc'), 3),
+    ('headers', Response('http://req-url', body=b'abc', headers={'Content-Length': 'wrong'}), 3),
+    ('headers', UnreadableBodyResponse('http://req-url', headers={'Content-Length': '10'}), 10),
+    ('meta', UnreadableBodyResponse('http://req-url'), 0),
+    ('meta', UnreadableBodyResponse('http://req-url', headers={'Content-Length': '10'}), 10),
+])
+def test_hs_downloader_middleware_response_size(monkeypatch_globals, monkeypatch, mode, response, expected):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    crawler = get_crawler(settings_dict={"HUBSTORAGE_RESPONSE_SIZE": mode})
+    mw = HubstorageDownloaderMiddleware.from_crawler(crawler)
+    mw._process_response(Request('http://req-url'), response)
+    assert mw.pipe_writer.write_request.call_args[1]["rs"] == expected
+
+
+def test_hs_downloader_middleware_response_size_from_meta(monkeypatch_globals, monkeypatch):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    crawler = get_crawler(settings_dict={"HUBSTORAGE_RESPONSE_SIZE": "meta"})
+    mw = HubstorageDownloaderMiddleware.from_crawler(crawler)
+    request = Request('http://req-url', meta={HS_RESPONSE_SIZE_KEY: 1234})
+    response = UnreadableBodyResponse('http://req-url', headers={'Content-Length': '10'}, request=request)
+    mw._process_response(request, response)
+    assert mw.pipe_writer.write_request.call_args[1]["rs"] == 1234
+
+
+def test_hs_downloader_middleware_sampling(monkeypatch_globals, monkeypatch):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    crawler = get_crawler(settings_dict={
+        "HUBSTORAGE_REQUEST_SAMPLE_RATE": 0,
+        "HUBSTORAGE_REQUEST_DROPPED_DOMAINS_MAX": 1,
+    })
+    mw = HubstorageDownloaderMiddleware.from_crawler(crawler)
+
+    request_0 = Request('http://a.example/', meta={'redirect_times': 1})
+    mw._process_response(request_0, Response(request_0.url, body=b'abc'))
+    assert mw.pipe_writer.write_request.call_count == 1
+    assert request_0.meta[HS_REQUEST_ID_KEY] == 0
+
+    # routine requests are dropped and don't get a request id
+    request_1 = Request('http://a.example/1', meta={HS_PARENT_ID_KEY: 0})
+    mw._process_response(request_1, Response(request_1.url, body=b'abcd'))
+    assert mw.pipe_writer.write_request.call_count == 1
+    assert request_1.meta[HS_REQUEST_ID_KEY] == 0
+    request_2 = Request('http://b.example/2', meta={HS_PARENT_ID_KEY: 0})
+    mw._process_response(request_2, Response(request_2.url, body=b'ab'))
+    assert mw.pipe_writer.write_request.call_count == 1
+
+    request_3 = Request('http://a.example/3', meta={HS_PARENT_ID_KEY: 0})
+    mw._process_response(request_3, Response(request_3.url, status=404))
+    assert mw.pipe_writer.write_request.call_count == 2
+    assert request_3.meta[HS_REQUEST_ID_KEY] == 1
+
+    assert crawler.stats.get_value('hubstorage/requests_dropped') == 2
+    assert crawler.stats.get_value('hubstorage/requests_dropped_bytes') == 6
+    assert crawler.stats.get_value('hubstorage/requests_dropped/a.example/count') == 1
+    assert crawler.stats.get_value('hubstorage/requests_dropped/a.example/bytes') == 4
+    assert crawler.stats.get_value('hubstorage/requests_dropped/other/count') == 1
+    assert crawler.stats.get_value('hubstorage/requests_dropped/other/bytes') == 2
+
+
+def test_hs_downloader_middleware_sampling_disabled_by_default(monkeypatch_globals, monkeypatch):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    mw = HubstorageDownloaderMiddleware.from_crawler(get_crawler())
+    for i in range(10):
+        request = Request('http://a.example/%d' % i)
+        mw._process_response(request, Response(request.url))
+    assert mw.pipe_writer.write_request.call_count == 10
+
+
+@deferred_f_from_coro_f
+async def test_hs_spider_middleware_async_output(hs_spider_middleware):
+    url = 'http://resp-url'
+    request_0 = Request(url)
+    response_0 = Response(url, request=request_0)
+    hs_spider_middleware._seen_requests[request_0] = 5
+    request_1 = Request(url, meta={HS_REQUEST_ID_KEY: 3})
+    item = {}
+
+    async def result():
+        yield request_1
+        yield item
+
+    if _SCRAPY_NO_SPIDER_ARG:
+        output = hs_spider_middleware.process_spider_output_async(response_0, result())
+    else:
+        output = hs_spider_middleware.process_spider_output_async(response_0, result(), Spider('test'))
+    processed_output = [x async for x in output]
+    assert processed_output[0] is request_1
+    assert processed_output[1] is item
+    assert request_1.meta == {HS_PARENT_ID_KEY: 5}
+    assert len(hs_spider_middleware._seen_requests) == 0
+
+
+def test_hs_downloader_middleware_persists_request_ids(monkeypatch_globals, monkeypatch, tmp_path):
+    monkeypatch.setattr('sh_scrapy.middlewares.pipe_writer', mock.Mock())
+    settings = {'JOBDIR': str(tmp_path / 'jobdir')}
+    spider = Spider('test')
+
+    mw = HubstorageDownloaderMiddleware.from_crawler(get_crawler(settings_dict=settings))
+    mw.spider_closed(spider)
+    assert not (tmp_path / 'jobdir' / 'hubstorage.state').exists()
+    for i in range(3):
+        request = Request('http://resp-url/%d' % i)
+        mw._process_response(request, Response(request.url))
+    assert request.meta[HS_REQUEST_ID_KEY] == 2
+    mw.spider_closed(spider)
+
+    resumed_mw = HubstorageDownloaderMiddleware.from_crawler(get_crawler(settings_dict=settings))
+    request = Request('http://resp-url/3', meta={HS_PARENT_ID_KEY: 2})
+    resumed_mw._process_response(request, Response(request.url))
+    assert request.meta[HS_REQUEST_ID_KEY] == 3
+    assert request.meta[HS_PARENT_ID_KEY] == 2
@@ -0,0 +1,58 @@
+import signal
+import sys
+
+import mock
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.profiler import SamplingProfiler, OTHER_STACKS
+
+
+@pytest.fixture
+def profiler():
+    crawler = get_crawler(Spider, {'PROFILER_ENABLED': True, 'PROFILER_MAX_STACKS': 2})
+    crawler.stats = mock.Mock()
+    return SamplingProfiler.from_crawler(crawler)
+
+
+def test_profiler_disabled_by_default():
+    crawler = get_crawler(Spider)
+    with pytest.raises(NotConfigured):
+        SamplingProfiler.from_crawler(crawler)
+
+
+def test_profiler_sample(profiler):
+    def inner():
+        profiler._sample(signal.SIGPROF, sys._getframe())
+
+    inner()
+    inner()
+    profiler._sample(signal.SIGPROF, sys._getframe())
+    stacks = profiler.stacks.most_common()
+    assert len(stacks) == 2
+    stack, count = stacks[0]
+    assert count == 2
+    assert stack.endswith(';tests.test_profiler:test_profiler_sample;tests.test_profiler:inner')
+    # new stacks over the limit are aggregated
+    profiler._sample(signal.SIGPROF, None)
+    assert profiler.stacks[OTHER_STACKS] == 1
+    assert len(profiler.stacks) == 3
+
+
+def test_profiler_output_file(profiler, tmp_path):
+    output = tmp_path / 'profile.collapsed'
+    profiler.output_file = str(output)
+    profiler.interval = 60
+    spider = Spider('test')
+    profiler.spider_opened(spider)
+    try:
+        assert signal.getsignal(signal.SIGPROF) == profiler._sample
+        profiler.stacks.update({'a;b': 3, 'a;c': 1})
+    finally:
+        profiler.spider_closed(spider, 'finished')
+    assert signal.getsignal(signal.SIGPROF) != profiler._sample
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    assert output.read_text() == 'a;b 3\na;c 1\n'
+    profiler.crawler.stats.set_value.assert_any_call('profiler/samples', 4)
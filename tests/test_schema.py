@@ -0,0 +1,85 @@
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.item import Field, Item
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.schema import ItemSchemaStats
+
+
+class Product(Item):
+    name = Field()
+    price = Field()
+
+
+@pytest.fixture
+def schema_stats():
+    crawler = get_crawler(Spider, {'SCHEMA_STATS_ENABLED': True})
+    return ItemSchemaStats.from_crawler(crawler)
+
+
+def test_schema_stats_disabled_by_default():
+    with pytest.raises(NotConfigured):
+        ItemSchemaStats.from_crawler(get_crawler(Spider))
+
+
+def test_schema_stats(schema_stats):
+    spider = Spider('test')
+    for item in [
+        {'name': 'a', 'price': 1.5, 'tags': ['x']},
+        {'name': '', 'price': 2, 'tags': []},
+        {'name': None, 'price': 0},
+        {'name': 'b', 'price': object()},
+        Product(name='c'),
+        'not an item',
+    ]:
+        schema_stats.item_scraped(item, spider)
+    schema_stats.spider_closed(spider, 'finished')
+    stats = schema_stats.stats.get_stats()
+    assert {k: v for k, v in stats.items() if k.startswith('schema/')} == {
+        'schema/dict/items': 4,
+        'schema/dict/name/presence': 1.0,
+        'schema/dict/name/fill_rate': 0.5,
+        'schema/dict/name/types': 'str:3,null:1',
+        'schema/dict/price/presence': 1.0,
+        'schema/dict/price/fill_rate': 1.0,
+        'schema/dict/price/types': 'int:2,float:1,other:1',
+        'schema/dict/tags/presence': 0.5,
+        'schema/dict/tags/fill_rate': 0.25,
+        'schema/dict/tags/types': 'list:2',
+        'schema/Product/items': 1,
+        'schema/Product/name/presence': 1.0,
+        'schema/Product/name/fill_rate': 1.0,
+        'schema/Product/name/types': 'str:1',
+    }
+
+
+def test_schema_stats_max_fields():
+    crawler = get_crawler(Spider, {'SCHEMA_STATS_ENABLED': True, 'SCHEMA_STATS_MAX_FIELDS': 2})
+    schema_stats = ItemSchemaStats.from_crawler(crawler)
+    spider = Spider('test')
+    schema_stats.item_scraped({'a': 1, 'b': 2, 'c': 3, 'd': 4}, spider)
+    schema_stats.item_scraped({'a': 1, 'e': 5}, spider)
+    schema_stats.item_scraped({'a': 1, 'f': None, 'g': ''}, spider)
+    assert list(schema_stats.fields['dict']) == ['a', 'b', '[other]']
+    schema_stats.spider_closed(spider, 'finished')
+    stats = schema_stats.stats
+    # each item counts once toward [other] presence and fill rate
+    assert stats.get_value('schema/dict/[other]/presence') == 1.0
+    assert stats.get_value('schema/dict/[other]/fill_rate') == 0.6667
+    assert stats.get_value('schema/dict/[other]/types') == 'str:1,int:3,null:1'
+    assert stats.get_value('schema/dict/b/presence') == 0.3333
+
+
+def test_schema_stats_item_type(schema_stats):
+    spider = Spider('test')
+    schema_stats.item_scraped({'_type': 'Product', 'name': 'a'}, spider)
+    schema_stats.item_scraped({'_type': 'Other', 'name': 'b'}, spider)
+    schema_stats.item_scraped({'name': 'c'}, spider)
+    schema_stats.item_scraped(Product(name='d'), spider)
+    schema_stats.spider_closed(spider, 'finished')
+    stats = schema_stats.stats
+    assert stats.get_value('schema/Product/items') == 2
+    assert stats.get_value('schema/Product/name/presence') == 1.0
+    assert stats.get_value('schema/Other/items') == 1
+    assert stats.get_value('schema/dict/items') == 1
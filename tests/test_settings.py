@@ -1,5 +1,7 @@
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
 import mock
 
 import pytest
@@ -7,6 +9,7 @@ from scrapy import version_info as scrapy_version
 from scrapy.settings import Settings
 from scrapy.utils.python import to_unicode
 
+import sh_scrapy.settings
 from sh_scrapy.settings import EntrypointSettings
 from sh_scrapy.settings import _enforce_required_settings
 from sh_scrapy.settings import _maybe_load_autoscraping_project
@@ -16,6 +19,7 @@ from sh_scrapy.settings import _load_addons
 from sh_scrapy.settings import _populate_settings_base
 from sh_scrapy.settings import _load_default_settings
 from sh_scrapy.settings import _update_old_classpaths
+from sh_scrapy.settings import get_setting_choice
 from sh_scrapy.settings import populate_settings
 
 
@@ -160,6 +164,20 @@ def test_get_action_on_missing_addons_warn_if_wrong_value():
     assert _get_action_on_missing_addons(o) == 'warn'
 
 
+@pytest.mark.parametrize('settings, expected', [
+    ({}, 'a'),
+    ({'CHOICE': 'b'}, 'b'),
+    ({'CHOICE': 'wrong'}, 'a'),
+])
+def test_get_setting_choice(settings, expected):
+    crawler = mock.Mock(settings=Settings(settings))
+    assert get_setting_choice(crawler, 'CHOICE', ('a', 'b')) == expected
+
+
+def test_get_setting_choice_without_crawler():
+    assert get_setting_choice(None, 'CHOICE', ('a', 'b')) == 'a'
+
+
 def test_load_addons_void():
     addons = []
     settings, o = EntrypointSettings(), EntrypointSettings()
@@ -244,6 +262,72 @@ def test_load_addons_hworker_import_replace():
     assert o['SPIDER_MIDDLEWARES'] == {'scrapy.utils.misc.arg_to_iter': 10}
 
 
+def _get_threaded_addons():
+    paths = ['scrapy.utils.misc.arg_to_iter', 'hworker.some.module',
+             'scrapy.utils.misc.load_object', 'hworker.other.module']
+    return [dict(TEST_ADDON, path=path, order=order)
+            for order, path in enumerate(paths, 1)]
+
+
+@pytest.mark.parametrize('on_missing_addons', ['warn', 'error'])
+def test_load_addons_threads(on_missing_addons, caplog):
+    results = []
+    for threads in (0, 4):
+        settings = {'SPIDER_MIDDLEWARES': {}}
+        o = EntrypointSettings()
+        o.setdict({'ON_MISSING_ADDONS': on_missing_addons,
+                   'ADDONS_IMPORT_THREADS': threads})
+        caplog.clear()
+        with mock.patch('sh_scrapy.settings.ThreadPoolExecutor',
+                        wraps=ThreadPoolExecutor) as executor:
+            missing = _load_addons(_get_threaded_addons(), settings, o)
+        assert executor.called == bool(threads)
+        results.append((missing, settings, [r.getMessage() for r in caplog.records]))
+    assert results[0] == results[1]
+    missing, settings, messages = results[1]
+    assert missing == 2
+    assert settings == {'SPIDER_MIDDLEWARES': {
+        'scrapy.utils.misc.arg_to_iter': 1, 'scrapy.utils.misc.load_object': 3}}
+    assert len(messages) == 2
+    assert 'hworker.some.module' in messages[0]
+    assert 'hworker.other.module' in messages[1]
+
+
+def test_load_addons_threads_main_thread_only(tmp_path, monkeypatch):
+    (tmp_path / 'mainthreadaddon.py').write_text(
+        'import signal\n'
+        'signal.signal(signal.SIGUSR2, signal.getsignal(signal.SIGUSR2))\n'
+        'class Addon:\n'
+        '    pass\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'mainthreadaddon', raising=False)
+    addons = _get_threaded_addons()
+    addons[1]['path'] = 'mainthreadaddon.Addon'
+    settings = {'SPIDER_MIDDLEWARES': {}}
+    o = EntrypointSettings()
+    o.setdict({'ON_MISSING_ADDONS': 'fail', 'ADDONS_IMPORT_THREADS': 4})
+    imported = mock.Mock(wraps=sh_scrapy.settings.load_object)
+    with mock.patch('sh_scrapy.settings.load_object', imported):
+        with pytest.raises(ImportError, match='hworker'):
+            _load_addons(addons, settings, o)
+    # imported again in the main thread after failing in the pool
+    assert [c[0][0] for c in imported.call_args_list].count('mainthreadaddon.Addon') == 2
+    assert settings == {'SPIDER_MIDDLEWARES': {
+        'scrapy.utils.misc.arg_to_iter': 1, 'mainthreadaddon.Addon': 2,
+        'scrapy.utils.misc.load_object': 3}}
+    monkeypatch.delitem(sys.modules, 'mainthreadaddon', raising=False)
+
+
+def test_load_addons_threads_fail_on_import():
+    settings = {'SPIDER_MIDDLEWARES': {}}
+    o = EntrypointSettings()
+    o.setdict({'ON_MISSING_ADDONS': 'fail', 'ADDONS_IMPORT_THREADS': 4})
+    with pytest.raises(ImportError, match='hworker'):
+        _load_addons(_get_threaded_addons(), settings, o)
+    # addons before the first missing one are loaded
+    assert settings == {'SPIDER_MIDDLEWARES': {'scrapy.utils.misc.arg_to_iter': 1}}
+
+
 def test_populate_settings_dont_fail():
     result = _populate_settings_base({}, lambda x: x)
     assert isinstance(result, Settings)
@@ -416,3 +500,29 @@ def test_update_old_classpaths_not_string():
     assert 123 in expected
     assert CustomObject in expected
     assert 'scrapy.exporter.CustomExporter' in expected
+
+
+@mock.patch('sh_scrapy.settings.DEPRECATED_PREFIXES', ('scrapy.contrib.',))
+@mock.patch('scrapy.utils.deprecate.DEPRECATION_RULES',
+            [('scrapy.contrib.', 'scrapy.extensions.')])
+def test_update_old_classpaths():
+
+    class CustomObject(object):
+        pass
+
+    test_settings = Settings({
+        'EXTENSIONS': {'scrapy.contrib.throttle.AutoThrottle': 10,
+                       'myproject.ext.Extension': 20, CustomObject: 30},
+        'ITEM_PIPELINES': {'scrapy.contrib.pipeline.Pipeline': 300},
+        'SOME_SETTING': {'scrapy.contrib.throttle.AutoThrottle': 1},
+    })
+    with pytest.warns(Warning):
+        _update_old_classpaths(test_settings)
+    assert dict(test_settings['EXTENSIONS']) == {
+        'scrapy.extensions.throttle.AutoThrottle': 10,
+        'myproject.ext.Extension': 20, CustomObject: 30}
+    assert dict(test_settings['ITEM_PIPELINES']) == {
+        'scrapy.extensions.pipeline.Pipeline': 300}
+    # only component dicts are updated
+    assert dict(test_settings['SOME_SETTING']) == {
+        'scrapy.contrib.throttle.AutoThrottle': 1}
@@ -0,0 +1,158 @@
+import os
+import sys
+
+import mock
+import pytest
+from scrapy.settings import Settings
+
+from sh_scrapy.settings import populate_settings
+from sh_scrapy.settingscache import SettingsCache
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    package = tmp_path / 'src' / 'cacheproject'
+    package.mkdir(parents=True)
+    (package / '__init__.py').write_text('')
+    (package / 'settings.py').write_text('BOT_NAME = "cacheproject"\n')
+    monkeypatch.syspath_prepend(str(tmp_path / 'src'))
+    monkeypatch.setenv('SCRAPY_SETTINGS_MODULE', 'cacheproject.settings')
+    monkeypatch.setenv('SHUB_SETTINGS_CACHE_DIR', str(tmp_path / 'cache'))
+    yield package
+    sys.modules.pop('cacheproject', None)
+    sys.modules.pop('cacheproject.settings', None)
+
+
+def get_apisettings(**job_settings):
+    return {'project_settings': {'SETTING': 'project'}, 'job_settings': job_settings}
+
+
+def populate(apisettings, spider='spider'):
+    with mock.patch('sh_scrapy.settings.get_project_settings',
+                    wraps=populate_settings.__globals__['get_project_settings']) as resolve:
+        settings = populate_settings(apisettings, spider)
+    return settings, resolve.called
+
+
+def test_cache_disabled(project, monkeypatch, tmp_path):
+    monkeypatch.delenv('SHUB_SETTINGS_CACHE_DIR')
+    assert populate(get_apisettings())[1]
+    assert populate(get_apisettings())[1]
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_cache_hit(project):
+    settings, resolved = populate(get_apisettings())
+    assert resolved
+    cached, resolved = populate(get_apisettings())
+    assert not resolved
+    assert cached['BOT_NAME'] == 'cacheproject'
+    assert cached['SETTING'] == 'project'
+    assert cached.getpriority('SETTING') == settings.getpriority('SETTING')
+    assert cached['EXTENSIONS_BASE'] == settings['EXTENSIONS_BASE']
+    # each job gets its own JOBDIR
+    assert cached['JOBDIR'] != settings['JOBDIR']
+    assert os.path.isdir(cached['JOBDIR'])
+
+
+def test_cache_jobdir_from_job_settings(project):
+    populate(get_apisettings(JOBDIR='/tmp/custom'))
+    cached, resolved = populate(get_apisettings(JOBDIR='/tmp/custom'))
+    assert not resolved
+    assert cached['JOBDIR'] == '/tmp/custom'
+
+
+def test_cache_invalidated_by_apisettings(project):
+    populate(get_apisettings(A=1))
+    settings, resolved = populate(get_apisettings(A=2))
+    assert resolved
+    assert settings['A'] == 2
+    assert populate(get_apisettings(A=1), spider='other')[1]
+
+
+def test_cache_invalidated_by_project_files(project):
+    populate(get_apisettings())
+    (project / 'settings.py').write_text('BOT_NAME = "changed"\n')
+    sys.modules.pop('cacheproject.settings', None)
+    settings, resolved = populate(get_apisettings())
+    assert resolved
+    assert settings['BOT_NAME'] == 'changed'
+    # other modules of the project are imported by the settings module
+    (project / 'other.py').write_text('')
+    assert populate(get_apisettings())[1]
+
+
+def test_cache_invalidated_by_installed_packages(project, tmp_path, monkeypatch):
+    site_packages = tmp_path / 'site-packages'
+    site_packages.mkdir()
+    monkeypatch.syspath_prepend(str(site_packages))
+    populate(get_apisettings())
+    assert not populate(get_apisettings())[1]
+    (site_packages / 'package.py').write_text('')
+    assert not populate(get_apisettings())[1]
+    (site_packages / 'package-1.0.dist-info').mkdir()
+    assert populate(get_apisettings())[1]
+
+
+def test_cache_invalidated_by_environment(project, monkeypatch):
+    populate(get_apisettings())
+    monkeypatch.setenv('SHUB_JOB_MEMORY_LIMIT', '2000')
+    settings, resolved = populate(get_apisettings())
+    assert resolved
+    assert settings['MEMUSAGE_LIMIT_MB'] == 2000
+
+
+def test_cache_per_job_environment(project, monkeypatch):
+    # job specific variables set by the entrypoint don't invalidate the cache
+    monkeypatch.setenv('SCRAPY_JOB', '1/2/3')
+    populate(get_apisettings())
+    monkeypatch.setenv('SCRAPY_JOB', '1/2/4')
+    assert not populate(get_apisettings())[1]
+
+
+def test_cache_per_job_environment_settings(tmp_path, monkeypatch):
+    # older Scrapy versions set settings from all SCRAPY_* variables
+    cache = SettingsCache(str(tmp_path))
+    settings = Settings({'JOB': '1/2/3'}, priority='project')
+    monkeypatch.setenv('SCRAPY_JOB', '1/2/3')
+    cache.store('key', settings, None)
+    monkeypatch.setenv('SCRAPY_JOB', '1/2/4')
+    assert cache.load('key')['JOB'] == '1/2/4'
+
+
+def test_cache_missing_addons_not_cached(project):
+    apisettings = get_apisettings()
+    apisettings['enabled_addons'] = [{
+        'path': 'missing.Addon', 'type': 'EXTENSIONS', 'order': 0, 'default_settings': {}}]
+    populate(apisettings)
+    assert populate(apisettings)[1]
+
+
+def test_cache_invalid_entry(project, tmp_path, caplog):
+    populate(get_apisettings())
+    for path in (tmp_path / 'cache').iterdir():
+        path.write_bytes(b'invalid')
+    settings, resolved = populate(get_apisettings())
+    assert resolved
+    assert settings['SETTING'] == 'project'
+    assert 'Ignoring invalid settings cache entry' in caplog.text
+    assert not populate(get_apisettings())[1]
+
+
+def test_cache_unpicklable_settings(project):
+    populate(get_apisettings())
+    (project / 'settings.py').write_text('FUNC = lambda: None\n')
+    sys.modules.pop('cacheproject.settings', None)
+    assert populate(get_apisettings())[1]
+    assert populate(get_apisettings())[1]
+
+
+def test_cache_read_only_directory(project, tmp_path, monkeypatch, caplog):
+    cache_dir = tmp_path / 'readonly'
+    cache_dir.mkdir()
+    monkeypatch.setenv('SHUB_SETTINGS_CACHE_DIR', str(cache_dir))
+    with mock.patch('sh_scrapy.settingscache.tempfile.mkstemp', side_effect=PermissionError('denied')):
+        settings, resolved = populate(get_apisettings())
+    assert resolved
+    assert settings['SETTING'] == 'project'
+    assert 'Failed to write settings cache entry' in caplog.text
@@ -0,0 +1,141 @@
+import builtins
+import logging
+import sys
+import threading
+import types
+
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy import startup
+from sh_scrapy.startup import StartupTrace
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    original_import = builtins.__import__
+    monkeypatch.setattr(startup, 'tracer', None)
+    try:
+        yield startup.start()
+    finally:
+        startup.tracer.uninstall()
+        assert builtins.__import__ is original_import
+
+
+def test_phase_not_started(monkeypatch):
+    monkeypatch.setattr(startup, 'tracer', None)
+    with startup.phase('test'):
+        pass
+
+
+def test_tracer_phases(tracer):
+    assert startup.start() is tracer
+    with startup.phase('a'):
+        pass
+    tracer.mark('b')
+    assert set(tracer.phases) == {'a', 'b'}
+    assert all(elapsed >= 0 for elapsed in tracer.phases.values())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake perf_counter, advanced by modules importing startup_test_clock."""
+    clock = types.ModuleType('startup_test_clock')
+    clock.now = 0.0
+    monkeypatch.setitem(sys.modules, 'startup_test_clock', clock)
+    monkeypatch.setattr(startup, 'perf_counter', lambda: clock.now)
+    return clock
+
+
+@pytest.fixture
+def modules_dir(tmpdir, monkeypatch):
+    """Directory of startup_test_* modules, unloaded after the test."""
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield tmpdir
+    for name in list(sys.modules):
+        if name.startswith('startup_test_') and name != 'startup_test_clock':
+            del sys.modules[name]
+
+
+def test_tracer_imports(tracer, clock, modules_dir):
+    package = modules_dir.mkdir('startup_test_pkg')
+    package.join('__init__.py').write('from . import sub\nimport startup_test_mod\n')
+    package.join('sub.py').write('import startup_test_clock\nstartup_test_clock.now += 0.05\n')
+    modules_dir.join('startup_test_mod.py').write('import startup_test_clock\nstartup_test_clock.now += 0.1\n')
+    modules_dir.join('startup_test_main.py').write('import startup_test_pkg\n')
+    __import__('startup_test_main')
+    # the time of nested top-level imports is excluded
+    assert tracer.imports['startup_test_main'] == pytest.approx(0)
+    assert tracer.imports['startup_test_pkg'] == pytest.approx(0.05)
+    assert tracer.imports['startup_test_mod'] == pytest.approx(0.1)
+
+
+def test_tracer_imports_threads(tracer, clock, modules_dir):
+    # startup_test_a ends while startup_test_b is being imported in another
+    # thread, and doesn't count as nested in it
+    clock.a_started, clock.b_started, clock.a_done = (threading.Event() for _ in range(3))
+    modules_dir.join('startup_test_a.py').write(
+        'import startup_test_clock as c\n'
+        'c.a_started.set()\nc.b_started.wait(5)\nc.now += 1\n')
+    modules_dir.join('startup_test_b.py').write(
+        'import startup_test_clock as c\n'
+        'c.b_started.set()\nc.a_done.wait(5)\nc.now += 2\n')
+
+    def import_b():
+        clock.a_started.wait(5)
+        __import__('startup_test_b')
+
+    thread = threading.Thread(target=import_b)
+    thread.start()
+    try:
+        __import__('startup_test_a')
+    finally:
+        clock.a_done.set()
+        thread.join()
+    assert tracer.imports['startup_test_a'] == pytest.approx(1)
+    assert tracer.imports['startup_test_b'] == pytest.approx(3)
+
+
+def test_startup_trace_not_started(monkeypatch):
+    monkeypatch.setattr(startup, 'tracer', None)
+    with pytest.raises(NotConfigured):
+        StartupTrace.from_crawler(get_crawler(Spider))
+
+
+def test_startup_trace(tracer, caplog):
+    tracer.imports.update({'a': 0.5, 'b': 0.2, 'c': 0.1})
+    crawler = get_crawler(Spider, {'STARTUP_TRACE_MAX_IMPORTS': 2})
+    extension = StartupTrace.from_crawler(crawler)
+    with caplog.at_level(logging.INFO):
+        extension.request_reached_downloader(Request('http://example.com'), None)
+        extension.request_reached_downloader(Request('http://example.com'), None)
+    stats = crawler.stats.get_stats()
+    assert set(stats) == {
+        'startup/total', 'startup/imports',
+        'startup/phase/crawler', 'startup/phase/first_request',
+        'startup/import/a', 'startup/import/b',
+    }
+    assert stats['startup/imports'] == 0.8
+    assert caplog.text.count('Startup took') == 1
+    assert 'Slowest imports: a 0.500s, b 0.200s' in caplog.text
+    assert builtins.__import__ is not tracer._import
+    extension.spider_closed(None, 'finished')
+    assert caplog.text.count('Startup took') == 1
+
+
+def test_startup_trace_no_request(tracer, caplog):
+    crawler = get_crawler(Spider)
+    extension = StartupTrace.from_crawler(crawler)
+    assert builtins.__import__ == tracer._import
+    with caplog.at_level(logging.INFO):
+        extension.spider_closed(None, 'finished')
+        extension.spider_closed(None, 'finished')
+    stats = crawler.stats.get_stats()
+    assert 'startup/total' in stats
+    assert 'startup/phase/crawler' in stats
+    assert 'startup/phase/first_request' not in stats
+    assert caplog.text.count('Startup took') == 1
+    assert builtins.__import__ is not tracer._import
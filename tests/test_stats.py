@@ -50,3 +50,38 @@ def test_collector_close_spider(collector):
         collector.close_spider('spider', 'reason')
     assert collector._samplestask.stop.called
     collector.pipe_writer.write_stats.assert_called_with(stats.copy())
+
+
+def test_collector_resources_disabled_by_default(collector):
+    collector._upload_stats()
+    uploaded = collector.pipe_writer.write_stats.call_args[0][0]
+    assert not any(key.startswith('resources/') for key in uploaded)
+
+
+def test_collector_upload_stats_with_resources(monkeypatch):
+    monkeypatch.setattr('sh_scrapy.stats.pipe_writer', mock.Mock())
+    crawler = get_crawler(Spider, {'STATS_RESOURCES_ENABLED': True})
+    collector = stats.HubStorageStatsCollector(crawler)
+    collector._upload_stats()
+    uploaded = collector.pipe_writer.write_stats.call_args[0][0]
+    assert uploaded['resources/rss'] > 0
+    assert uploaded['resources/rss_max'] >= uploaded['resources/rss']
+    assert uploaded['resources/cpu_user'] >= 0
+    assert uploaded['resources/cpu_system'] >= 0
+    assert uploaded['resources/open_fds'] > 0
+    assert uploaded['resources/gc/gen0_collections'] >= 0
+    # the lag needs two consecutive periodic uploads
+    assert 'resources/loop_lag' not in uploaded
+
+
+def test_collector_loop_lag(monkeypatch):
+    monkeypatch.setattr('sh_scrapy.stats.pipe_writer', mock.Mock())
+    crawler = get_crawler(Spider, {'STATS_RESOURCES_ENABLED': True})
+    collector = stats.HubStorageStatsCollector(crawler)
+    collector._samplestask = mock.Mock(running=True)
+    monotonic = mock.Mock(side_effect=[100.0, 100.0 + collector.INTERVAL + 2.5])
+    monkeypatch.setattr('sh_scrapy.stats.time.monotonic', monotonic)
+    collector._upload_stats()
+    collector._upload_stats()
+    assert collector.get_value('resources/loop_lag') == 2.5
+    assert collector.get_value('resources/loop_lag_max') == 2.5
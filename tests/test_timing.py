@@ -0,0 +1,122 @@
+from collections import defaultdict, deque
+from functools import partial
+from inspect import iscoroutinefunction
+
+import mock
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import deferred_f_from_coro_f
+from scrapy.utils.test import get_crawler
+
+from sh_scrapy.timing import ComponentTiming
+
+
+class Component:
+    def process_request(self, request, spider):
+        return request
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            yield x * 2
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for x in result:
+            yield x * 2
+
+    async def process_item(self, item):
+        return item
+
+
+PREFIX = 'component_timing/tests.test_timing.Component/'
+
+
+@pytest.fixture
+def timing():
+    crawler = get_crawler(Spider, {'COMPONENT_TIMING_ENABLED': True})
+    return ComponentTiming.from_crawler(crawler)
+
+
+def test_component_timing_disabled_by_default():
+    crawler = get_crawler(Spider)
+    with pytest.raises(NotConfigured):
+        ComponentTiming.from_crawler(crawler)
+
+
+def test_component_timing_instrument(timing):
+    component = Component()
+    manager = mock.Mock(methods=defaultdict(deque), _mw_methods_requiring_spider=set())
+    manager.methods['process_request'].append(component.process_request)
+    manager.methods['process_spider_output'].append(
+        (component.process_spider_output, component.process_spider_output_async))
+    manager.methods['process_item'].append(None)
+    manager.methods['open_spider'].append(component.process_request)
+    manager.methods['process_start'].append(component.process_request)
+    manager._mw_methods_requiring_spider.add(component.process_request)
+    timing._instrument(manager)
+
+    wrapped = manager.methods['process_request'][0]
+    assert wrapped != component.process_request
+    assert wrapped in manager._mw_methods_requiring_spider
+    assert wrapped('request', 'spider') == 'request'
+    assert timing.stats.get_value(PREFIX + 'process_request/calls') == 1
+    assert timing.stats.get_value(PREFIX + 'process_request/time') >= 0
+    sync, async_ = manager.methods['process_spider_output'][0]
+    assert sync != component.process_spider_output
+    assert async_ != component.process_spider_output_async
+    assert manager.methods['process_item'][0] is None
+    # only process_* methods are instrumented
+    assert manager.methods['open_spider'][0] == component.process_request
+    # start methods run before spider_opened
+    assert manager.methods['process_start'][0] == component.process_request
+
+
+class CallableComponent:
+    def __call__(self, request, spider):
+        return request
+
+
+def test_component_timing_method_names(timing):
+    component = CallableComponent()
+    manager = mock.Mock(methods=defaultdict(deque), _mw_methods_requiring_spider=None)
+    manager.methods['process_request'].append(component)
+    manager.methods['process_response'].append(partial(Component().process_request, 'response'))
+    timing._instrument(manager)
+    assert manager.methods['process_request'][0]('request', 'spider') == 'request'
+    assert manager.methods['process_response'][0]('spider') == 'response'
+    stats = timing.stats.get_stats()
+    assert stats['component_timing/tests.test_timing.CallableComponent/process_request/calls'] == 1
+    assert stats[PREFIX + 'process_response/calls'] == 1
+
+
+def test_component_timing_sync_output(timing):
+    component = Component()
+    wrapped = timing._wrap(component.process_spider_output, 'process_spider_output', None)
+    assert list(wrapped('response', result=iter([1, 2, 3]), spider=None)) == [2, 4, 6]
+    assert timing.stats.get_value(PREFIX + 'process_spider_output/calls') == 1
+    assert timing.stats.get_value(PREFIX + 'process_spider_output/time') >= 0
+
+
+@deferred_f_from_coro_f
+async def test_component_timing_async_output_excludes_upstream(timing):
+    clock = [0.0]
+
+    async def upstream():
+        for x in [1, 2]:
+            clock[0] += 10
+            yield x
+
+    wrapped = timing._wrap(Component().process_spider_output_async, 'process_spider_output_async', None)
+    with mock.patch('sh_scrapy.timing.perf_counter', lambda: clock[0]):
+        result = [x async for x in wrapped('response', upstream(), 'spider')]
+    assert result == [2, 4]
+    assert timing.stats.get_value(PREFIX + 'process_spider_output_async/calls') == 1
+    assert timing.stats.get_value(PREFIX + 'process_spider_output_async/time') == 0
+
+
+@deferred_f_from_coro_f
+async def test_component_timing_coroutine(timing):
+    wrapped = timing._wrap(Component().process_item, 'process_item', None)
+    assert iscoroutinefunction(wrapped)
+    assert await wrapped({'a': 1}) == {'a': 1}
+    assert timing.stats.get_value(PREFIX + 'process_item/calls') == 1
@@ -0,0 +1,118 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import mock
+import pytest
+
+from sh_scrapy import crawl, hsref, writer
+from sh_scrapy.worker import _read_request, _run_job, main, submit
+from tests.utils import create_project
+
+
+def test_main_without_socket_path(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['start-crawl-server'])
+    monkeypatch.delenv('SHUB_WORKER_SOCKET', raising=False)
+    assert main() == 2
+    assert 'usage' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('request_line, env', [
+    (b'{"env": {"A": "1"}}\n', {'A': '1'}),
+    (b'{"env": {"A": 1}}\n', None),
+    (b'{"A": "1"}\n', None),
+    (b'[]\n', None),
+    (b'not json\n', None),
+])
+def test_read_request(request_line, env):
+    server, client = socket.socketpair()
+    with server, client:
+        client.sendall(request_line)
+        if env is None:
+            with pytest.raises(ValueError):
+                _read_request(server)
+        else:
+            assert _read_request(server) == env
+
+
+def test_run_job(monkeypatch):
+    monkeypatch.setattr(os, 'environ', dict(os.environ, HWORKER_SENTRY_DSN='server-dsn'))
+    monkeypatch.setattr(crawl, 'main', mock.Mock(return_value=0))
+    monkeypatch.setattr(crawl, '_sentry_dsn', None)
+    monkeypatch.setattr(hsref, 'hsref', hsref._HubstorageRef())
+    monkeypatch.setattr(writer, 'pipe_writer', writer._PipeWriter(''))
+    registered = []
+    monkeypatch.setattr('sh_scrapy.worker.atexit.register', lambda *args: registered.append(args))
+    server, client = socket.socketpair()
+    with server, client:
+        env = {'SHUB_JOBKEY': '1/2/3', 'SHUB_FIFO_PATH': '/tmp/fifo', 'SENTRY_DSN': 'job-dsn'}
+        client.sendall(json.dumps({'env': env}).encode() + b'\n')
+        assert _run_job(server) == 0
+        assert client.recv(100) == '{{"pid": {}}}\n'.format(os.getpid()).encode()
+    assert crawl.main.called
+    assert crawl._sentry_dsn == 'job-dsn'
+    assert 'SENTRY_DSN' not in os.environ
+    assert hsref.hsref.jobkey == '1/2/3'
+    assert writer.pipe_writer.path == '/tmp/fifo'
+    assert writer.pipe_writer.open != writer._not_configured
+    assert registered[0][2] == {'exit_code': 0}
+
+
+def test_run_job_invalid_request(monkeypatch):
+    monkeypatch.setattr(crawl, 'main', mock.Mock(return_value=0))
+    server, client = socket.socketpair()
+    with server, client:
+        client.sendall(b'[]\n')
+        assert _run_job(server) == 1
+        assert 'error' in json.loads(client.recv(1000))
+    assert not crawl.main.called
+
+
+def test_worker(tmp_path):
+    project_dir = create_project(tmp_path)
+    socket_path = str(tmp_path / 'worker.sock')
+    fifo = str(tmp_path / 'fifo')
+    os.mkfifo(fifo)
+    server = subprocess.Popen([sys.executable, '-m', 'sh_scrapy.worker', socket_path],
+                              cwd=str(project_dir), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+        # a client not sending its request doesn't delay other jobs
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(socket_path)
+        for jobid in (1, 2):
+            lines = []
+
+            def read_from_fifo():
+                with open(fifo) as f:
+                    lines.extend(f)
+
+            reader = threading.Thread(target=read_from_fifo)
+            reader.start()
+            job = {'key': '1/2/{}'.format(jobid), 'spider': 'myspider', 'auth': 'x'}
+            env = {'SHUB_JOB_DATA': json.dumps(job), 'SHUB_FIFO_PATH': fifo}
+            assert submit(socket_path, env, timeout=60) == 0
+            reader.join(timeout=5)
+            assert 'FIN {"outcome":"finished"}\n' in lines
+        stalled.setblocking(False)
+        with pytest.raises(BlockingIOError):
+            stalled.recv(1000)
+        stalled.setblocking(True)
+        stalled.shutdown(socket.SHUT_WR)
+        with stalled:
+            assert 'error' in json.loads(stalled.recv(1000))
+        with pytest.raises(ValueError):
+            submit(socket_path, {'SHUB_JOB_DATA': 1}, timeout=60)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=10)
+    assert server.returncode == 0, server.stderr.read()
+    assert not os.path.exists(socket_path)
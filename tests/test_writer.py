@@ -5,9 +5,10 @@ import os
 import threading
 from queue import Queue
 
+import mock
 import pytest
 
-from sh_scrapy.writer import _PipeWriter
+from sh_scrapy.writer import _PipeWriter, _SpillFile, _get_spill_file
 
 
 @pytest.fixture
@@ -144,3 +145,107 @@ def test_writer_raises_runtime_error_if_not_configured():
     with pytest.raises(RuntimeError) as exc_info:
         w.close()
     assert exc_info.value.args[0] == error_msg
+
+
+def _read_segments(directory):
+    data = b''
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            data += f.read()
+    return data
+
+
+def test_spill_file(tmpdir):
+    spill = _SpillFile(str(tmpdir), segment_size=10)
+    spill.append(b'0123456789')
+    spill.append(b'abc')
+    spill.append(b'def')
+    assert sorted(os.listdir(str(tmpdir))) == ['segment-000000.log', 'segment-000001.log']
+    assert spill.pending == 16
+    assert spill.peek(4) == b'0123'
+    spill.consume(4)
+    assert spill.peek(100) == b'456789'
+    spill.consume(6)
+    # consumed segments are removed
+    assert spill.peek(100) == b'abcdef'
+    assert os.listdir(str(tmpdir)) == ['segment-000001.log']
+    spill.consume(6)
+    assert spill.pending == 0
+    assert spill.peek(100) == b''
+    spill.close()
+    # segments of previous runs are kept
+    spill = _SpillFile(str(tmpdir))
+    spill.append(b'x')
+    spill.close()
+    assert sorted(os.listdir(str(tmpdir))) == ['segment-000001.log', 'segment-000002.log']
+
+
+@pytest.mark.parametrize('fsync, calls', [('never', 0), ('segment', 1), ('always', 3)])
+def test_spill_file_fsync(tmpdir, fsync, calls):
+    spill = _SpillFile(str(tmpdir), segment_size=10, fsync=fsync)
+    with mock.patch('sh_scrapy.writer.os.fsync') as os_fsync:
+        spill.append(b'0123456789')
+        spill.append(b'abc')
+        assert os_fsync.call_count == calls
+
+
+def test_spill_file_wrong_fsync(tmpdir):
+    with pytest.raises(ValueError):
+        _SpillFile(str(tmpdir), fsync='sometimes')
+
+
+def test_get_spill_file(tmpdir, monkeypatch):
+    monkeypatch.delenv('SHUB_SPILL_DIR', raising=False)
+    assert _get_spill_file() is None
+    monkeypatch.setenv('SHUB_SPILL_DIR', str(tmpdir))
+    monkeypatch.setenv('SHUB_SPILL_SEGMENT_SIZE', '1024')
+    monkeypatch.setenv('SHUB_SPILL_FSYNC', 'segment')
+    spill = _get_spill_file()
+    assert (spill.directory, spill.segment_size, spill.fsync) == (str(tmpdir), 1024, 'segment')
+
+
+@pytest.mark.parametrize('name, value', [
+    ('SHUB_SPILL_SEGMENT_SIZE', '64M'),
+    ('SHUB_SPILL_FSYNC', 'sometimes'),
+])
+def test_get_spill_file_invalid(tmpdir, monkeypatch, caplog, name, value):
+    monkeypatch.setenv('SHUB_SPILL_DIR', str(tmpdir))
+    monkeypatch.setenv(name, value)
+    assert _get_spill_file() is None
+    assert 'Spill file disabled, invalid SHUB_SPILL_* settings' in caplog.text
+    assert value in caplog.text
+
+
+def test_spill_writer_without_pipe(tmpdir):
+    w = _PipeWriter('', _SpillFile(str(tmpdir)))
+    w.open()
+    w.write_item({'foo': 'bar'})
+    w.set_outcome('finished')
+    w.close()
+    assert _read_segments(str(tmpdir)) == b'ITM {"foo":"bar"}\nFIN {"outcome":"finished"}\n'
+
+
+def test_spill_writer_overflow(fifo, tmpdir):
+    # open the reading end first so that opening the writer doesn't block
+    read_fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+    w = _PipeWriter(fifo, _SpillFile(str(tmpdir.mkdir('spill')), segment_size=1024))
+    w.open()
+    items = [{'n': i, 'data': 'x' * 100} for i in range(2000)]
+    for item in items:
+        w.write_item(item)
+    # the pipe is full and nobody reads it
+    assert w.spill.pending > 0
+
+    lines = []
+
+    def read_from_fifo():
+        os.set_blocking(read_fd, True)
+        with os.fdopen(read_fd, 'rb') as f:
+            lines.extend(iter(f.readline, b''))
+
+    reader_thread = threading.Thread(target=read_from_fifo)
+    reader_thread.start()
+    w.close()
+    reader_thread.join(timeout=5)
+    assert w.spill.pending == 0
+    assert [_parse_data_line(line.decode())[1] for line in lines] == items